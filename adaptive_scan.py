@@ -0,0 +1,146 @@
+import threading
+import time
+import traceback
+
+import numpy as np
+
+import scan_engine
+import scan_plan
+
+"""
+Adaptive axial scans. A coarse, uniform pass over the whole range is followed
+by refinement passes that only visit new positions in the intervals where the
+shift changes fastest (relative to its uncertainty) or where the slices are
+noisy (large fit uncertainty, low signal), until the time budget is used up.
+Homogeneous regions like the aqueous and the vitreous stay at the coarse
+spacing while the corneal and lens boundaries are sampled densely.
+
+Every pass is an ordinary scan on the scan_engine.ScanEngine, so it is
+written, paused and aborted like any other. The store callback has to append
+(position, shift, shift_error) to scan.results for every sample slice.
+"""
+
+
+# a failed fit counts like an end this many times noisier than the median
+FAILED_NOISE = 4.0
+
+
+# score of every interval between neighbouring positions (sorted): the shift step
+# in units of its uncertainty, plus how much noisier than the median its noisier end is
+def interval_scores(shifts, errors, gradient_weight=1.0, noise_weight=0.5):
+    shifts = np.asarray(shifts, dtype=np.float64)
+    errors = np.nan_to_num(np.asarray(errors, dtype=np.float64))
+    valid = errors > 0
+    typical = np.median(errors[valid]) if valid.any() else 1.0
+    errors = np.where(valid, errors, typical)
+
+    step = np.abs(np.diff(shifts))/np.sqrt(errors[:-1]**2 + errors[1:]**2)
+    # a failed fit at either end says nothing about the gradient, it only counts as noise
+    failed = ~np.isfinite(step)
+    step = np.where(failed, 0.0, step)
+    noise = np.maximum(errors[:-1], errors[1:])/typical - 1
+    noise = np.where(failed, np.maximum(noise, FAILED_NOISE), noise)
+    return gradient_weight*step + noise_weight*noise
+
+
+# midpoints of the (at most max_points) best scoring intervals that score at least
+# threshold and are still wider than 2*min_step, sorted by position
+def refine(positions, shifts, errors, max_points, min_step, threshold=2.0, gradient_weight=1.0, noise_weight=0.5):
+    order = np.argsort(positions)
+    positions = np.asarray(positions, dtype=np.float64)[order]
+    if len(positions) < 2 or max_points <= 0:
+        return np.zeros(0)
+    scores = interval_scores(np.asarray(shifts)[order], np.asarray(errors)[order], gradient_weight, noise_weight)
+    widths = np.diff(positions)
+    scores = np.where((widths >= 2*min_step) & (scores >= threshold), scores, -np.inf)
+
+    best = np.argsort(scores)[::-1][:max_points]
+    best = best[np.isfinite(scores[best])]
+    return np.sort((positions[best] + positions[best + 1])/2)
+
+
+class AdaptiveScan(object):
+    def __init__(self, engine, start, length, coarse_steps, budget, min_step=1.0, threshold=2.0,
+                 gradient_weight=1.0, noise_weight=0.5, max_passes=10):
+        self.engine = engine
+        self.start_position = start
+        self.length = length
+        self.coarse_steps = coarse_steps
+        # seconds for the whole adaptive scan, coarse pass included
+        self.budget = budget
+        self.min_step = min_step
+        self.threshold = threshold
+        self.gradient_weight = gradient_weight
+        self.noise_weight = noise_weight
+        self.max_passes = max_passes
+
+        # (position, shift, shift_error) of every sample slice so far
+        self.results = []
+        self.scans = []
+        # abort() and submitting the next pass exclude each other, so no pass starts after an abort
+        self.lock = threading.Lock()
+        self.aborted = False
+        self.error = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, args=())
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def abort(self):
+        with self.lock:
+            self.aborted = True
+            for scan in self.scans:
+                scan.abort()
+
+    # runs one pass and returns its scan, None if the adaptive scan was aborted before
+    def _pass(self, positions, name):
+        with self.lock:
+            if self.aborted:
+                return None
+            scan = self.engine.submit(scan_plan.points(positions), name)
+            self.scans.append(scan)
+        scan.wait()
+        self.results.extend(scan.results)
+        return scan
+
+    def _run(self):
+        try:
+            started = time.time()
+            coarse = self.start_position + self.length*np.arange(self.coarse_steps)/float(max(self.coarse_steps - 1, 1))
+            scan = self._pass(coarse, "adaptive_0")
+            # a pass aborted while still queued never started, so there is no time per point
+            if scan is not None and scan.state == scan_engine.DONE:
+                # seconds per point as measured on the coarse pass, moves and analysis included
+                per_point = (scan.finished - scan.started)/max(scan.index, 1)
+
+            for n in range(1, self.max_passes + 1):
+                if scan is None or scan.state != scan_engine.DONE or self.aborted or not self.results:
+                    break
+                remaining = self.budget - (time.time() - started)
+                max_points = int(remaining/per_point)
+                positions, shifts, errors = np.array(self.results, dtype=np.float64).T
+                new = refine(positions, shifts, errors, max_points, self.min_step, self.threshold,
+                             self.gradient_weight, self.noise_weight)
+                if len(new) == 0:
+                    break
+                # start from the end closer to where the last pass left the motor
+                if abs(new[-1] - positions[-1]) < abs(new[0] - positions[-1]):
+                    new = new[::-1]
+                print "adaptive scan pass",n,":",len(new),"new points,",round(remaining, 1),"s left"
+                scan = self._pass(new, "adaptive_%d" % n)
+        except Exception:
+            self.error = traceback.format_exc()
+            print "Error in adaptive scan"
+            print "Stack trace: ", self.error
+        print "adaptive scan finished with",len(self.results),"points"
+
+    # (positions, shifts, shift errors) of all sample slices sorted by position
+    def profile(self):
+        if not self.results:
+            return np.zeros(0), np.zeros(0), np.zeros(0)
+        results = np.array(self.results, dtype=np.float64)
+        results = results[np.argsort(results[:, 0])]
+        return results[:, 0], results[:, 1], results[:, 2]
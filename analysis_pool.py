@@ -0,0 +1,172 @@
+
+import multiprocessing
+import threading
+import time
+import traceback
+import Queue
+
+import frame_ring
+import spectrum_analysis
+
+"""
+Producer/consumer pipeline between the EMCCD acquisition thread and the
+spectrum analysis. The acquisition thread only submits frames, as slots of a
+shared frame_ring.FrameRing tagged with a sequence number, into a bounded
+queue. A dispatcher thread hands them to a process pool and the finished
+results are put back into frame order before they are given to the GUI side
+through the results queue. A frame whose result has not come back after
+max_wait seconds (e.g. its worker died) is skipped, so one lost job cannot
+stall the results for good.
+
+Worker processes import this module, so nothing here may touch the cameras
+or Tkinter.
+"""
+
+
+# view of the shared frame ring inside a worker process, set by _attach_ring
+_ring = None
+
+
+def _attach_ring(raw, slots):
+    global _ring
+    _ring = frame_ring.attach(raw, slots)
+
+
+# runs in the worker processes, errors are returned instead of raised so one
+# bad frame does not stall the re-ordering
+def _run_job(seq, slot, shape, job):
+    try:
+        frame = _ring[slot, :shape[0]*shape[1]].reshape(shape)
+        return seq, spectrum_analysis.analyze_frame(frame, **job), None
+    except Exception:
+        return seq, None, traceback.format_exc()
+
+
+class AnalysisPool(object):
+    def __init__(self, ring, processes=None, maxsize=None, max_wait=5.0):
+        self.ring = ring
+        self.processes = processes or multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(self.processes, initializer=_attach_ring, initargs=(ring.raw, ring.slots))
+
+        # frame slots waiting for a worker, and ordered (seq, result, error) tuples
+        self.frames = Queue.Queue(maxsize or 2*self.processes)
+        self.results = Queue.Queue()
+
+        # limits how many frames are handed to the pool at the same time
+        self.in_flight = threading.BoundedSemaphore(2*self.processes)
+        self.reorder_lock = threading.Lock()
+        self.pending = {}
+        self.next_seq = 0
+        self.dropped = 0
+        # seq -> [slot, dispatched] of every frame submitted and not analyzed yet
+        self.held = {}
+        # frames skipped because their result never came back
+        self.max_wait = max_wait
+        self.lost = 0
+        self.blocked_since = None
+
+        self.stopEvent = threading.Event()
+        self.dispatcher = threading.Thread(target=self._dispatch, args=())
+        self.dispatcher.daemon = True
+        self.dispatcher.start()
+
+    # called by the acquisition thread, returns False if the frame was dropped
+    # because the queue is full and block is False, or the pool or stop (an
+    # optional threading.Event) was stopped while waiting. The slot is released
+    # back to the ring once the frame has been analyzed or dropped.
+    def submit(self, seq, slot, shape, job, block=True, stop=None):
+        with self.reorder_lock:
+            self.held[seq] = [slot, False]
+        while True:
+            try:
+                self.frames.put((seq, slot, shape, job), block, 0.1)
+                return True
+            except Queue.Full:
+                if not block or self.stopEvent.is_set() or (stop is not None and stop.is_set()):
+                    break
+        self.dropped += 1
+        with self.reorder_lock:
+            self.held.pop(seq, None)
+        self.ring.release(slot)
+        self._collect((seq, None, None))
+        return False
+
+    def _dispatch(self):
+        while not self.stopEvent.is_set():
+            self._skip_lost()
+            try:
+                seq, slot, shape, job = self.frames.get(timeout=0.1)
+            except Queue.Empty:
+                continue
+            # lost jobs never give their place back until they are skipped
+            while not self.in_flight.acquire(False):
+                if self.stopEvent.wait(0.01):
+                    return
+                self._skip_lost()
+            with self.reorder_lock:
+                skipped = seq not in self.held
+                if not skipped:
+                    self.held[seq][1] = True
+            if skipped:
+                self.in_flight.release()
+                continue
+            self.pool.apply_async(_run_job, (seq, slot, shape, job), callback=lambda item, slot=slot: self._done(item, slot))
+
+    def _done(self, item, slot):
+        with self.reorder_lock:
+            # a frame that was skipped as lost already gave back its slot
+            if self.held.pop(item[0], None) is None:
+                return
+        self.ring.release(slot)
+        self.in_flight.release()
+        self._collect(item)
+
+    # stores results until every earlier sequence number has arrived, then
+    # releases them in order; dropped frames arrive as (seq, None, None)
+    def _collect(self, item):
+        with self.reorder_lock:
+            self.pending[item[0]] = item
+            self._release_ready()
+
+    # called with reorder_lock held
+    def _release_ready(self):
+        released = False
+        while self.next_seq in self.pending:
+            seq, result, error = self.pending.pop(self.next_seq)
+            self.next_seq += 1
+            released = True
+            if result is not None or error is not None:
+                self.results.put((seq, result, error))
+        if not self.pending:
+            self.blocked_since = None
+        elif released or self.blocked_since is None:
+            self.blocked_since = time.time()
+
+    # gives up on the frames results are waiting for once that took longer than
+    # max_wait, their slots go back to the ring
+    def _skip_lost(self):
+        with self.reorder_lock:
+            if self.blocked_since is None or time.time() - self.blocked_since < self.max_wait:
+                return
+            first = min(self.pending)
+            lost = [(seq, self.held.pop(seq)) for seq in range(self.next_seq, first) if seq in self.held]
+            self.lost += first - self.next_seq
+            print "analysis results of frames",self.next_seq,"to",first - 1,"never came back, skipped"
+            self.next_seq = first
+            self._release_ready()
+        for seq, (slot, dispatched) in lost:
+            self.ring.release(slot)
+            if dispatched:
+                self.in_flight.release()
+
+    # stops the workers; frames that were queued or still being analyzed give
+    # their slots back to the ring so nobody waiting for one blocks forever
+    def close(self):
+        self.stopEvent.set()
+        self.pool.terminate()
+        self.pool.join()
+        with self.reorder_lock:
+            held = self.held
+            self.held = {}
+        for slot, dispatched in held.values():
+            self.ring.release(slot)
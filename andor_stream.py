@@ -0,0 +1,89 @@
+
+import threading
+import time
+import Queue
+
+"""
+Continuous (run till abort) EMCCD acquisition. The camera is armed once and
+keeps filling its circular buffer; a drain thread waits for new images, pulls
+everything that is available into free slots of a frame_ring.FrameRing and
+stamps every frame with a sequence number and a host timestamp. The consumer
+takes slot indices from self.frames, the same way it would after a single
+scan acquisition.
+"""
+
+
+class AndorStream(object):
+    def __init__(self, andor, ring):
+        self.andor = andor
+        self.ring = ring
+        self.frames = Queue.Queue()
+        self.seq = 0
+        # images overwritten in the camera's circular buffer before we read them
+        self.lost = 0
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    def start(self, seq=0):
+        self.seq = seq
+        self.lost = 0
+        self.stopEvent.clear()
+        self.andor.start_continuous()
+        self.thread = threading.Thread(target=self._drain, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    # stops the camera and returns the next unused sequence number, frames
+    # that were drained but not consumed yet are given back to the ring and
+    # their sequence numbers reused
+    def stop(self):
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.andor.stop_continuous()
+
+        unused = []
+        while not self.frames.empty():
+            unused.append(self.frames.get())
+        if unused:
+            self.seq = int(self.ring.seq[unused[0]])
+        for slot in unused:
+            self.ring.release(slot)
+        return self.seq
+
+    # a free slot of the ring, or None once the stream is stopped; slots are only
+    # freed by the consumer, which may itself be waiting in stop()
+    def _claim(self):
+        while not self.stopEvent.is_set():
+            try:
+                return self.ring.claim(0.1)
+            except Queue.Empty:
+                pass
+        return None
+
+    def _drain(self):
+        last_read = None
+        while not self.stopEvent.is_set():
+            if not self.andor.wait_for_image(500):
+                continue
+            now = time.time()
+            images = self.andor.new_images()
+            if images is None:
+                continue
+            first, last = images
+            if last_read is not None and first > last_read + 1:
+                self.lost += first - last_read - 1
+
+            for index in range(first, last + 1):
+                slot = self._claim()
+                if slot is None:
+                    # stopped while the ring was full, the rest of the images are dropped with the camera buffer
+                    return
+                self.andor.image_into(index, self.ring, slot)
+                self.ring.seq[slot] = self.seq
+                # images drained together were exposed one kinetic cycle apart
+                self.ring.timestamp[slot] = now - (last - index)*self.andor.cycle_time
+                self.ring.started[slot] = self.ring.timestamp[slot] - self.andor.cycle_time
+                self.frames.put(slot)
+                self.seq += 1
+            last_read = last
@@ -13,8 +13,23 @@ import os
 import sys 
 import traceback
 import Queue
-import hough_transform as ht
-import skvideo.io as skv
+import pupil_detectors
+import pupil_tracker
+import analysis_pool
+import frame_ring
+import andor_stream
+import spectral_roi
+import shift_history
+import display_scheduler
+import mako_capture
+import pupil_recorder
+import raw_store
+import pupil_log
+import scan_engine
+import scan_writer
+import scan_plan
+import adaptive_scan
+import spectrum_analysis
 
 # device imports
 import device_init
@@ -28,7 +43,7 @@ import matplotlib
 matplotlib.use('TkAgg')
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
-from scipy.optimize import curve_fit
+import lorentzian_fit as lf
 
 
 
@@ -44,29 +59,49 @@ class App(threading.Thread):
         #threads and locks
         self.thread = None
         self.thread2 = None
+        self.thread3 = None
         self.stopEvent = None
         
         self.lock = threading.Lock()
-        self.record_lock = threading.Lock()
         self.condition = threading.Condition()
+        # the zaber serial port is shared by the motor buttons and the scan engine
+        self.motor_lock = threading.Lock()
         self.stopEvent = threading.Event()
 
 
         # initialize and access cameras, motors and graphs
         self.mako = device_init.Mako_Camera()
         self.andor = device_init.Andor_Camera()
-        self.motor = device_init.Motor()
+        # zaber devices daisy chained on the motor port: 1 for the axial stage, 2 with a lateral stage
+        self.motor_axes = 1
+        self.motor = device_init.Motor(axes = self.motor_axes)
         self.graph = Graph()
 
+        # worker processes that analyze EMCCD frames off the acquisition thread,
+        # frames are shared with them through a preallocated ring of buffers
+        self.andor_ring = frame_ring.FrameRing(self.andor.cam.width*self.andor.cam.height, slots = 16)
+        self.analysis = analysis_pool.AnalysisPool(self.andor_ring)
+        self.andor_stream = andor_stream.AndorStream(self.andor, self.andor_ring)
+        self.andor_seq = 0
+        self.roi = None
+
 
         self.outputPath = outputPath
-        self.frame = self.mako.camera.getFrame()
-        self.frame.announceFrame()
-        self.image = None
+        # ring of pupil camera buffers filled by Vimba callbacks
+        self.mako_capture = mako_capture.MakoCapture(self.mako, buffers = 8)
+        # takeSnapshot leaves the path here and videoLoop saves the next frame to it
+        self.snapshot_path = None
+        # width of the pupil camera panel
+        self.display_width = 1024
         self.image_andor = None
         self.analyzed_row = np.zeros(80)
 
-        self.brillouin_shift_list = []
+        # brillouin shifts of the sample, with block averages of 100 shifts kept for the whole session
+        self.shift_history = shift_history.ShiftHistory(capacity = 100000, decimation = 100)
+        # number of most recent shifts shown in the graph
+        self.plot_points = 1000
+        # stage acceleration in um/s^2, only used to estimate scan durations
+        self.scan_acceleration = 50000.0
         self.PlasticBS =  9.6051
         self.WaterBS = 5.1157
 
@@ -77,16 +112,36 @@ class App(threading.Thread):
         self.panelB = None
         #where graphs are drawn
         self.canvas = FigureCanvasTkAgg(self.graph.fig, master = self.root)
+        self.canvas.get_tk_widget().grid(row = 1, column = 6, columnspan = 3, rowspan = 6)    #pack(side = "right")
+        self.graph.attach(self.canvas)
 
         # GUI constants
-        self.pupil_video_frames = []
-        self.pupil_data_list = []
-        self.andor_image_list = []
+        # pupil_recorder.PupilRecorder while Record is on
+        self.recorder = None
+        # raw_store.RawStoreWriter of each camera while Raw is on, only used by its camera thread
+        self.pupil_store = None
+        self.andor_store = None
+        # pupil_log.PupilLog of every pupil frame of the current recording, only used by videoLoop
+        self.pupil_log = None
         self.scan_ready = False
+        self.scan_request_time = 0
         self.andor_export_image = None
+        # scan_writer.ScanWriter of each running scan
+        self.scan_writers = {}
+        # adaptive_scan.AdaptiveScan started by the last adaptive scan, None otherwise
+        self.adaptive_scan = None
+        # (timestamp, (frame, seq, job)) of every EMCCD frame while a continuous scan sweeps, None otherwise
+        self.sweep_frames = None
+        self.sweep_lock = threading.Lock()
         self.click_pos = None
         self.release_pos = None
         self.expected_pupil_radius = 0
+        # pupil detection backend, can be switched from the GUI, and the kalman tracker that
+        # only runs it every few frames and smooths its results
+        self.pupil_detector = pupil_detectors.create("Hough")
+        self.pupil_tracker = pupil_tracker.KalmanPupilTracker(self.pupil_detector)
+        # name of the detector chosen in the GUI, videoLoop switches to it between frames
+        self.requested_detector = self.pupil_detector.name
 
 
         ##########################
@@ -102,6 +157,18 @@ class App(threading.Thread):
         record_btn = tki.Checkbutton(self.root, text="Record", variable = self.record, command=self.triggerRecord, indicatoron = 0)
         record_btn.grid(row=3, column=1, sticky="w")
 
+        #selects the pupil detection algorithm
+        self.detector_name = tki.StringVar()
+        self.detector_name.set(self.pupil_detector.name)
+        detector_label = tki.Label(self.root, text = "Pupil detector").grid(row = 9, column = 0, sticky = "w")
+        detector_menu = tki.OptionMenu(self.root, self.detector_name, *sorted(pupil_detectors.DETECTORS), command = self.set_detector)
+        detector_menu.grid(row = 9, column = 1, sticky = "w")
+
+        #records every frame of both cameras losslessly, with motor position and shutter state
+        self.raw = tki.IntVar()
+        raw_btn = tki.Checkbutton(self.root, text="Raw", variable = self.raw, indicatoron = 0)
+        raw_btn.grid(row = 9, column = 2, sticky = "w")
+
 
         ###################
         ### GRAPH PANEL ###
@@ -126,6 +193,15 @@ class App(threading.Thread):
         SD_entry = tki.Entry(self.root, textvariable = self.SD)
         SD_entry.grid(row = 3, column = 5, sticky = "w")
 
+        #latest brillouin shift and its uncertainty
+        self.shift_label_var = tki.StringVar()
+        shift_label = tki.Label(self.root, textvariable = self.shift_label_var)
+        shift_label.grid(row = 4, column = 5, sticky = "sw")
+
+        #clears the shift history and its statistics
+        clear_btn = tki.Button(self.root, text = "Clear shifts", command = self.shift_history.reset)
+        clear_btn.grid(row = 8, column = 6, sticky = "w")
+
 
         ###################
         ### MOTOR PANEL ###
@@ -135,7 +211,7 @@ class App(threading.Thread):
         motor_label.grid(row = 4, column = 0, pady=10, sticky = "sw")
 
         #home button for motor
-        home_btn = tki.Button(self.root, text = "Home", command = lambda: self.move_motor_home())
+        home_btn = tki.Button(self.root, text = "Home", command = lambda: self.gui_motor(self.move_motor_home))
         home_btn.grid(row = 5, column = 0, sticky = "nw")
 
    		#entry for user to input distance to move motor forward or backward
@@ -146,11 +222,11 @@ class App(threading.Thread):
         distance_entry.grid(row = 5, column = 1, sticky = "nw")
 
         #moves motor forward by given distance from above
-        forward_button = tki.Button(self.root, text = "Forward", command = lambda: self.move_motor_relative(distance_var.get()))
+        forward_button = tki.Button(self.root, text = "Forward", command = lambda: self.gui_motor(self.move_motor_relative, distance_var.get()))
         forward_button.grid(row = 5, column = 2, sticky = "nw")
 
         #moves motor backwards by given distance from above
-        back_button = tki.Button(self.root, text = "Backwards", command = lambda: self.move_motor_relative(-distance_var.get()))
+        back_button = tki.Button(self.root, text = "Backwards", command = lambda: self.gui_motor(self.move_motor_relative, -distance_var.get()))
         back_button.grid(row = 5, column = 3, sticky = "nw")
 
         #shows current location of motor on rails
@@ -162,7 +238,7 @@ class App(threading.Thread):
         location_entry.grid(row = 5, column = 4, sticky = "nw")
 
         #can enter a different location above and move motor to entered location
-        position_button = tki.Button(self.root, text =  "Move to Position", command = lambda: self.move_motor_abs(self.location_var.get()))
+        position_button = tki.Button(self.root, text =  "Move to Position", command = lambda: self.gui_motor(self.move_motor_abs, self.location_var.get()))
         position_button.grid(row = 5, column = 5, sticky = "nw")
 
 
@@ -195,19 +271,71 @@ class App(threading.Thread):
        	scan_btn = tki.Button(self.root, text="Start Scan", command = lambda: self.slice_routine(start_pos.get(),scan_length.get(),num_frames.get()))
         scan_btn.grid(row = 7, column = 3)
 
+        #pause/resume and abort the running scan, and its progress
+        self.scan_paused = tki.IntVar()
+        pause_btn = tki.Checkbutton(self.root, text="Pause Scan", variable = self.scan_paused, command = self.pause_scan, indicatoron = 0)
+        pause_btn.grid(row = 9, column = 3, sticky = "w")
+        #continuous scan, the motor sweeps over the length at the velocity below while frames are taken
+        self.scan_sweep = tki.IntVar()
+        sweep_btn = tki.Checkbutton(self.root, text="Sweep", variable = self.scan_sweep, indicatoron = 0)
+        sweep_btn.grid(row = 6, column = 3)
+        #number of passes over the scan (every other one backwards) and reference frames every n points
+        self.scan_passes = tki.IntVar()
+        self.scan_passes.set(1)
+        passes_label = tki.Label(self.root, text = "Passes ").grid(row = 10, column = 0, sticky = "e")
+        passes_entry = tki.Entry(self.root, textvariable = self.scan_passes, width = 5)
+        passes_entry.grid(row = 10, column = 1, sticky = "w")
+        self.scan_reference_every = tki.IntVar()
+        self.scan_reference_every.set(0)
+        reference_every_label = tki.Label(self.root, text = "Ref every ").grid(row = 10, column = 2, sticky = "e")
+        reference_every_entry = tki.Entry(self.root, textvariable = self.scan_reference_every, width = 5)
+        reference_every_entry.grid(row = 10, column = 3, sticky = "w")
+        #adaptive scan, a coarse pass with the number of frames above, then more frames where the shift
+        #changes fastest or the fits are noisy until the time budget is used up
+        self.scan_adaptive = tki.IntVar()
+        adaptive_btn = tki.Checkbutton(self.root, text="Adaptive", variable = self.scan_adaptive, indicatoron = 0)
+        adaptive_btn.grid(row = 10, column = 4, sticky = "w")
+        self.scan_budget = tki.IntVar()
+        self.scan_budget.set(60)
+        budget_label = tki.Label(self.root, text = "Budget(s) ").grid(row = 10, column = 5, sticky = "e")
+        budget_entry = tki.Entry(self.root, textvariable = self.scan_budget, width = 5)
+        budget_entry.grid(row = 10, column = 6, sticky = "w")
+        #explicit scan positions instead of start/length/frames, visited in the shortest order from the current position
+        self.scan_positions = tki.StringVar()
+        positions_label = tki.Label(self.root, text = "Positions(um) ").grid(row = 11, column = 0, sticky = "e")
+        positions_entry = tki.Entry(self.root, textvariable = self.scan_positions)
+        positions_entry.grid(row = 11, column = 1, columnspan = 2, sticky = "we")
+        #lateral length and steps on the second axis, more than one step makes the scan a serpentine grid
+        self.scan_lateral_length = tki.IntVar()
+        self.scan_lateral_length.set(0)
+        lateral_label = tki.Label(self.root, text = "Lateral(um) ").grid(row = 11, column = 3, sticky = "e")
+        lateral_entry = tki.Entry(self.root, textvariable = self.scan_lateral_length, width = 5)
+        lateral_entry.grid(row = 11, column = 4, sticky = "w")
+        self.scan_lateral_steps = tki.IntVar()
+        self.scan_lateral_steps.set(1)
+        lateral_steps_label = tki.Label(self.root, text = "Lat. steps ").grid(row = 11, column = 5, sticky = "e")
+        lateral_steps_entry = tki.Entry(self.root, textvariable = self.scan_lateral_steps, width = 5)
+        lateral_steps_entry.grid(row = 11, column = 6, sticky = "w")
+        abort_btn = tki.Button(self.root, text="Abort Scan", command = self.abort_scan)
+        abort_btn.grid(row = 9, column = 4, sticky = "w")
+        self.scan_label_var = tki.StringVar()
+        self.scan_label_var.set("No scan")
+        scan_label = tki.Label(self.root, textvariable = self.scan_label_var)
+        scan_label.grid(row = 9, column = 5, columnspan = 2, sticky = "w")
+
 
         ##########################################
         ### VELOCITY AND ACCELERATION CONTROLS ###
         ##########################################
 
         #controls to enter and change velocity of motor
-        velocity_var = tki.IntVar()
-        velocity_var.set(0)
+        self.velocity_var = tki.IntVar()
+        self.velocity_var.set(0)
         velocity_label = tki.Label(self.root, text="Velocity").grid(row = 6, column = 4)
-        velocity_entry = tki.Entry(self.root, textvariable = velocity_var)
+        velocity_entry = tki.Entry(self.root, textvariable = self.velocity_var)
         velocity_entry.grid(row = 7, column = 4)
 
-        velocity_btn = tki.Button(self.root, text="Change velocity", command = lambda: self.set_velocity(velocity_var.get()))
+        velocity_btn = tki.Button(self.root, text="Change velocity", command = lambda: self.gui_motor(self.set_velocity, self.velocity_var.get()))
         velocity_btn.grid(row = 7, column = 5)
 
 
@@ -215,189 +343,323 @@ class App(threading.Thread):
         #TODO
 
 
+        #####################
+        ### EMCCD CONTROL ###
+        #####################
+
+        #continuous acquisition keeps the EMCCD running into its circular buffer instead of one scan per frame
+        self.continuous = tki.IntVar()
+        self.continuous.set(0)
+        continuous_btn = tki.Checkbutton(self.root, text = "Continuous", variable = self.continuous, indicatoron = 0)
+        continuous_btn.grid(row = 8, column = 0, sticky = "w")
+
+        #only read out the rows and columns around the spectral line, found from a full frame
+        self.crop = tki.IntVar()
+        self.crop.set(1)
+        crop_btn = tki.Checkbutton(self.root, text = "Crop ROI", variable = self.crop, indicatoron = 0)
+        crop_btn.grid(row = 8, column = 1, sticky = "w")
+
+        #fast mode only estimates the peaks in closed form, the full fit runs every Nth frame or on demand
+        self.fast_mode = tki.IntVar()
+        fast_btn = tki.Checkbutton(self.root, text = "Fast", variable = self.fast_mode, indicatoron = 0)
+        fast_btn.grid(row = 8, column = 2, sticky = "w")
+
+        fit_every_label = tki.Label(self.root, text = "Fit every ").grid(row = 8, column = 3, sticky = "e")
+        self.fit_every = tki.IntVar()
+        self.fit_every.set(0)
+        fit_every_entry = tki.Entry(self.root, textvariable = self.fit_every)
+        fit_every_entry.grid(row = 8, column = 4, sticky = "w")
+
+        self.fit_requested = False
+        fit_btn = tki.Button(self.root, text = "Fit now", command = self.request_fit)
+        fit_btn.grid(row = 8, column = 5, sticky = "w")
+
+
+        #loop to update CMOS, EMCCD, and graph panels in GUI
+        #All changes to GUI must happen in one thread so to achieve this: 
+        #videoLoop and analysisLoop post their latest CMOS, EMCCD and graph data to the display scheduler
+        #This main Tkinter thread shows the newest item of each panel at that panel's frame rate, older ones are dropped
+        self.display = display_scheduler.DisplayScheduler(self.root)
+        self.display.add_panel("panelA", self.show_panelA, fps = 15, convert = self.pupil_photo)
+        self.display.add_panel("panelB", self.show_panelB, fps = 15, convert = self.andor_photo)
+        self.display.add_panel("scan", self.show_scan, fps = 10)
+        self.display.add_panel("graph", self.show_graph, fps = 20)
+
+        # scans run on their own thread and report their progress to the "scan" panel
+        self.scan_engine = scan_engine.ScanEngine(self.scan_move, self.scan_acquire, self.scan_store, self.scan_finish,
+                                                  on_event = self.scan_event, sweep = self.scan_sweep_frames)
+
         #initialize and start threads
         self.thread = threading.Thread(target=self.videoLoop, args=())
         self.thread2 = threading.Thread(target=self.andorLoop, args=())
+        self.thread3 = threading.Thread(target=self.analysisLoop, args=())
         self.thread.start()
         self.thread2.start()
+        self.thread3.start()
 
         #set a callback to handle when the window is closed
         self.root.wm_title("Brillouin Scan Interface")
         self.root.wm_protocol("WM_DELETE_WINDOW", self.onClose)
 
+        self.display.start()
+
+    # annotates the downscaled mono pupil camera frame and converts it to the form used by tkinter
+    def pupil_photo(self, item):
+        small, pupil, detected, scale = item
+        image = cv2.cvtColor(small, cv2.COLOR_GRAY2RGB)
+        # detections in blue, predictions in between in green (RGB)
+        pupil_detectors.draw(image, pupil, scale = scale, color = (0,0,255) if detected else (0,255,0))
+        return ImageTk.PhotoImage(Image.fromarray(image))
+
+    # converts the 8-bit EMCCD crop to the form used by tkinter
+    def andor_photo(self, cropped):
+        image = imutils.resize(cropped, width=1024)
+        return ImageTk.PhotoImage(Image.fromarray(image))
+
+    def show_panelA(self, item):
+        if self.panelA is None:
+            self.panelA = tki.Label(self.root,image=item)
+            self.panelA.image = item
+            self.panelA.grid(row = 0, column = 0, columnspan = 6, rowspan = 3) #pack(side="left", padx=10, pady=10)
+        else:
+            self.panelA.configure(image=item)
+            self.panelA.image = item
 
-        #loop to update CMOS, EMCCD, and graph panels in GUI
-        #All changes to GUI must happen in one thread so to achieve this: 
-        #videoLoop and andorLoop adds CMOS, EMCCD and graph images to a thread-safe queue
-        #This main Tkinter thread dequeues images one by one and updates their respective panels on the GUI
-        self.queue = Queue.Queue()
-        self.update_root()
+    def show_panelB(self, item):
+        if self.panelB is None:
+            self.panelB = tki.Label(self.root,image=item)
+            self.panelB.grid_propagate(0)
+            self.panelB.image = item
+            self.panelB.grid(row = 0, column = 6, columnspan = 3, sticky = "n") #pack(side="left", padx=10, pady=10)
 
-    #Dequeues items from self.queue and updates respective widgets in the GUI
-    def update_root(self):
+            self.panelB.configure(bg="red")
+        else:
+            self.panelB.configure(image=item)
+            self.panelB.grid_propagate(0)
+            self.panelB.image = item
 
-        while not self.stopEvent.is_set():
-            try:
-                destination, item = self.queue.get(timeout=0.1)
-
-                if destination == "panelA":
-                    if self.panelA is None:
-                        self.panelA = tki.Label(self.root,image=item)
-                        self.panelA.image = item
-                        self.panelA.grid(row = 0, column = 0, columnspan = 6, rowspan = 3) #pack(side="left", padx=10, pady=10)
-                    else:
-                        self.panelA.configure(image=item)
-                        self.panelA.image = item
-
-                elif destination == "panelB":
-                    if self.panelB is None:
-                        self.panelB = tki.Label(self.root,image=item)
-                        self.panelB.grid_propagate(0)
-                        self.panelB.image = item
-                        self.panelB.grid(row = 0, column = 6, columnspan = 3, sticky = "n") #pack(side="left", padx=10, pady=10)
-
-                        self.panelB.configure(bg="red")
-                    else:
-                        self.panelB.configure(image=item)
-                        self.panelB.grid_propagate(0)
-                        self.panelB.image = item
-                
-                elif destination == "scatter":
-                    self.graph.fig.clf()
-                    subplot = self.graph.fig.add_subplot(211)
-                    subplot.set_xlabel("Pixel")
-                    subplot.set_ylabel("Counts")
-
-                    brillouin_plot = self.graph.fig.add_subplot(212)
-
-                    copied_analyzed_row,brillouin_shift_list = item
-                    subplot.scatter(self.graph.x_axis, copied_analyzed_row, s = 1)
-                    brillouin_plot.scatter(np.arange(1, len(brillouin_shift_list)+1), np.array(brillouin_shift_list))
-
-                    self.canvas.show()
-                    self.canvas.get_tk_widget().grid(row = 1, column = 6, columnspan = 3, rowspan = 6)    #pack(side = "right")
-                
-                #elif destination == "plot":
-                #    popt = item
-                #    subplot.plot(self.graph.x_axis, lorentzian(self.graph.x_axis, *popt), 'r-', label='fit')
-
-            except:
-                #print "break"
-                break
-        self.root.after(300,self.update_root)
+    # item is the analyzed row and its fit parameters (None if not fitted)
+    def show_graph(self, item):
+        row, popt = item
+        shifts = self.shift_history.window(self.plot_points)
+        self.graph.update_spectrum(row)
+        self.graph.update_fit(popt)
+        self.graph.update_shifts(shifts["seq"], shifts["shift"])
+        self.graph.redraw()
 
 
     #Loop for thread for CMOS camera - almost exact same as mako_pupil.py
     def videoLoop(self):
-        self.mako.camera.startCapture()
-        self.mako.camera.runFeatureCommand('AcquisitionStart')
-        self.frame.queueFrameCapture()
+        self.mako_capture.start()
 
 
         while not self.stopEvent.is_set():
             #print "videoLoop"
             # self.root.update()
-            self.frame.waitFrameCapture(1000)
-            self.frame.queueFrameCapture()
-            imgData = self.frame.getBufferByteData()
-            image = np.ndarray(buffer = imgData,
-                           dtype = np.uint8,
-                           shape = (self.frame.height,self.frame.width))    
+            frame = self.mako_capture.get(timeout = 1.0)
+            if frame is None:
+                continue
+            # view on the camera buffer, valid until the frame is released below
+            image = frame.image
             
             
-            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
-
+            # detector and tracker are only touched by this thread
+            if self.requested_detector != self.pupil_detector.name:
+                self.pupil_detector = pupil_detectors.create(self.requested_detector)
+                self.pupil_tracker.detector = self.pupil_detector
+                self.pupil_tracker.reset()
+            detector = self.pupil_detector
             if self.click_pos is not None and self.release_pos is not None:
                 expected_pupil_radius = int(math.sqrt((self.click_pos[0] - self.release_pos[0])**2 + (self.click_pos[1] - self.release_pos[1])**2)/2)
-                pupil_data = ht.detect_pupil_frame(image,expected_pupil_radius,15)
-            else:
-                pupil_data = ht.detect_pupil_frame(image)
-
-
-            if self.record.get() == 1:
-                with self.record_lock:
-
-                    self.pupil_video_frames.append(pupil_data[0].copy())
-                    self.pupil_data_list.append((pupil_data[1],pupil_data[2]))
-                    print "added frame to list"
-                    
-
-            self.image = pupil_data[0]
-            # convets image to form used by tkinter
-            image = cv2.cvtColor(pupil_data[0].copy(), cv2.COLOR_BGR2RGB)
-            image = imutils.resize(image, width=1024)
-            image = Image.fromarray(image)
-            image = ImageTk.PhotoImage(image)
-    	
-            self.queue.put(("panelA",image))
+                detector.set_expected_radius(expected_pupil_radius)
+            # detection runs on the native mono buffer and only returns numbers,
+            # the pupil is drawn later onto the downscaled display image
+            tracked = self.pupil_tracker.update(image, frame.timestamp)
+            pupil = tracked.result
+
+
+            # every recording has its own log at <path>.log with a record for each frame
+            recorder = self.recorder
+            log_path = None if recorder is None else recorder.path + ".log"
+            if self.pupil_log is not None and self.pupil_log.path != log_path:
+                self.pupil_log.close()
+                self.pupil_log = None
+            if recorder is not None:
+                if self.pupil_log is None:
+                    self.pupil_log = pupil_log.PupilLog(log_path)
+                # andor_seq is the sequence number the next EMCCD frame will get
+                self.pupil_log.append(frame.seq, frame.host_time, frame.timestamp, pupil.center, pupil.radius, tracked.detected,
+                                      self.andor_seq - 1, pupil.confidence, detector.name, tracked.blink, tracked.saccade)
+                recorder.write(image, frame.seq, frame.timestamp)
+
+            self.pupil_store = self.record_raw(self.pupil_store, "pupil_raw", image, frame.seq, frame.timestamp)
+
+            if self.snapshot_path is not None:
+                cv2.imwrite(self.snapshot_path, image)
+                print("[INFO] saved {}".format(self.snapshot_path))
+                self.snapshot_path = None
+
+            # the small copy also frees the display from the camera buffer, which is requeued
+            scale = float(self.display_width)/image.shape[1]
+            small = cv2.resize(image, (self.display_width, int(round(image.shape[0]*scale))), interpolation = cv2.INTER_AREA)
+            self.mako_capture.release(frame)
+            self.display.post("panelA",(small, pupil, tracked.detected, scale))
+
+        if self.pupil_store is not None:
+            self.pupil_store.close()
+        if self.pupil_log is not None:
+            self.pupil_log.close()
 
 
      #almost exactly same as andor_test.py 
-     #graphing is called in a function graphLoop()
+     #only acquires frames, analysis is done by self.analysis and shown by analysisLoop
     def andorLoop(self):
+        streaming = False
         while not self.stopEvent.is_set():
             #print "andorLoop"
-            self.andor.cam.StartAcquisition() 
-            data = []                                            
-            self.andor.cam.GetAcquiredData(data)
-            """
-            while data == []:
-                continue
-            """
-            image_array = np.array(data, dtype = np.uint16)
-            maximum = image_array.max()
-
-
-            graph_data = list(data)  
-            graph_array = np.array(graph_data, dtype = np.uint16)
-            reshaped_graph = np.reshape(graph_array, (-1, 512))
-
-            proper_image = np.reshape(image_array, (-1, 512))
-
-
-            scaled_image = proper_image*(255.0/maximum)
-            scaled_image = scaled_image.astype(int)
-            scaled_8bit= np.array(scaled_image, dtype = np.uint8)
-
-
-            if self.scan_ready: 
+            if self.continuous.get() == 1:
+                if not streaming:
+                    self.andor_stream.start(self.andor_seq)
+                    streaming = True
+                try:
+                    slot = self.andor_stream.frames.get(timeout=0.5)
+                except Queue.Empty:
+                    continue
+                self.andor_seq = self.andor_ring.seq[slot] + 1
+            else:
+                if streaming:
+                    self.andor_seq = self.andor_stream.stop()
+                    streaming = False
+                slot = self.claim_slot()
+                if slot is None:
+                    break
+                started = time.time()
+                self.andor.cam.StartAcquisition() 
+                self.andor.acquire_into(self.andor_ring, slot)
+                self.andor_ring.seq[slot] = self.andor_seq
+                self.andor_ring.timestamp[slot] = time.time()
+                self.andor_ring.started[slot] = started
+                self.andor_seq += 1
+            proper_image = self.andor_ring.view(slot, self.andor.frame_shape)
+            # sensor area and binning of this frame, saved with it (the ROI may crop and bin it)
+            readout = self.andor.readout
+            self.andor_store = self.record_raw(self.andor_store, "andor_raw", proper_image, self.andor_ring.seq[slot], self.andor_ring.timestamp[slot],
+                                               {"readout": readout})
+
+            with self.lock:
+                state = self.shutter_state.get()
+            fit_every = self.fit_every.get()
+            fit = self.fast_mode.get() == 0 or self.fit_requested or (fit_every > 0 and self.andor_ring.seq[slot] % fit_every == 0)
+            self.fit_requested = False
+            job = {"reference": state == 1,
+                   "FSR": self.FSR.get(),
+                   "SD": self.SD.get(),
+                   "plastic_bs": self.PlasticBS,
+                   "water_bs": self.WaterBS,
+                   "fit": fit,
+                   "timestamp": self.andor_ring.timestamp[slot]}
+
+            # skip frames whose exposure started before the scan asked for one, e.g. while the stage was
+            # still moving (the frame is analyzed and written on the scan engine's export thread)
+            if self.scan_ready and self.andor_ring.started[slot] >= self.scan_request_time:
                 self.condition.acquire()
                 #print "andorloop lock acquired"
-                self.andor_export_image = Image.fromarray(scaled_8bit)
+                self.andor_export_image = (proper_image.copy(), self.andor_ring.seq[slot], job, readout)
                 self.scan_ready = False
                 self.condition.notifyAll()
                 #print "threads notified"
                 self.condition.release()
                 #print "lock released"
 
-            loc = np.argmax(scaled_8bit)/512
-            left_right = scaled_8bit[loc].argsort()[-10:][::-1]
-            left_right.sort()
-            mid = int((left_right[0]+left_right[-1])/2)
+            # every frame is kept while a continuous scan sweeps
+            with self.sweep_lock:
+                if self.sweep_frames is not None:
+                    self.sweep_frames.append((self.andor_ring.timestamp[slot], (proper_image.copy(), self.andor_ring.seq[slot], job, readout)))
+
+            # switch between full frame readout and the cropped, binned spectral ROI,
+            # decided before the slot is handed over to the analysis
+            roi = self.roi
+            if self.crop.get() == 1 and roi is None:
+                roi = spectral_roi.locate_roi(proper_image, self.andor.hbin, self.andor.vbin)
+                print "spectral ROI: rows",roi.row_start,roi.row_end,"columns",roi.col_start,roi.col_end
+            elif roi is not None and (self.crop.get() == 0 or not roi.check(proper_image)):
+                print "spectral ROI lost, reading full frame"
+                roi = None
+
+            self.analysis.submit(self.andor_ring.seq[slot], slot, self.andor.frame_shape, job, stop = self.stopEvent)
+
+            # the camera can only be reconfigured while it is not acquiring
+            if roi is not self.roi:
+                if streaming:
+                    self.andor_seq = self.andor_stream.stop()
+                    streaming = False
+                self.andor.set_readout(roi)
+                self.roi = roi
+
+        if streaming:
+            self.andor_stream.stop()
+        if self.andor_store is not None:
+            self.andor_store.close()
+
+    #a free slot of the EMCCD frame ring, None once the application is closing
+    def claim_slot(self):
+        while not self.stopEvent.is_set():
+            try:
+                return self.andor_ring.claim(0.1)
+            except Queue.Empty:
+                pass
+        return None
 
-        
-            self.analyzed_row = reshaped_graph[loc][mid-40:mid+40]
+    #takes analyzed frames from self.analysis in acquisition order and updates the EMCCD panel and graphs
+    def analysisLoop(self):
+        while not self.stopEvent.is_set():
+            try:
+                seq, result, error = self.analysis.results.get(timeout=0.1)
+            except Queue.Empty:
+                continue
+
+            if error is not None:
+                print "Error analyzing frame ",seq
+                print "Stack trace: ", error
+                continue
 
+            self.graphLoop(seq, result)
 
-            cropped = scaled_8bit[loc-7:loc+7, mid-40:mid+40]
-            self.graphLoop()
-            print(cropped.shape,loc)
-            (h, w)= cropped.shape[:2]
+            (h, w)= result["display"].shape[:2]
             if w <= 0 or h <= 0:
                 continue
 
-            self.image_andor = cropped
+            self.image_andor = result["display"]
+            self.display.post("panelB",self.image_andor)
 
-            image = imutils.resize(self.image_andor, width=1024)
-            image = Image.fromarray(image)
             
+    #appends frame to store while Raw is on and returns the store to keep using,
+    #a new store is started when recording starts or the frame shape or metadata changes (EMCCD ROI)
+    def record_raw(self, store, name, frame, seq, timestamp, metadata=None):
+        if self.raw.get() == 0:
+            if store is not None:
+                store.close()
+                print "closed raw recording",store.path
+            return None
+        if store is not None and (store.shape != frame.shape or store.metadata != (metadata or {})):
+            store.close()
+            store = None
+        if store is None:
+            ts = datetime.datetime.now()
+            path = os.path.join("data_acquisition", "{}_{}_{}".format(name, ts.strftime("%Y-%m-%d_%H-%M-%S"), seq))
+            store = raw_store.RawStoreWriter(path, frame.shape, frame.dtype, capacity = 100, metadata = metadata)
+            print "raw recording to",path
 
-            image = ImageTk.PhotoImage(image)
-
+        with self.lock:
+            shutter = self.shutter_state.get()
+            position = self.location_var.get()
+        store.append(frame, seq, timestamp, position, shutter)
+        return store
 
-            self.queue.put(("panelB",image))
+    #asks for a full lorentzian fit of the next frame while in fast mode
+    def request_fit(self):
+        self.fit_requested = True
 
-            
     #similar to shutters.py, called on by reference button 
     def shutters(self, close = False):
         dll = WinDLL("C:\\Program Files\\quad-shutter\\Quad Shutter dll and docs\\x64\\PiUsb")
@@ -420,134 +682,259 @@ class App(threading.Thread):
         dll.piDisconnectShutter(usb314)
 
      #plots graphs, similar to how graphs are plotted on andoru_test.py
-     #uses figure so both plots can be shown at same time
-    def graphLoop(self):
-        #self.graph.fig.clf()
-        #subplot = self.graph.fig.add_subplot(211)
-        #subplot.set_xlabel("Pixel")
-        #subplot.set_ylabel("Counts")
-
-        #brillouin_plot = self.graph.fig.add_subplot(212)
-
-
-        copied_analyzed_row = np.array(self.analyzed_row)
-        print len(copied_analyzed_row)
-
-        with self.lock:
-            state = self.shutter_state.get() 
+     #uses the result of spectrum_analysis.analyze_frame for frame seq
+    def graphLoop(self, seq, result):
+        self.analyzed_row = result["row"]
 
-        try:
-            
-            if state == 0:
-                constant_1 = np.amax(copied_analyzed_row[:40])
-                constant_2 = np.amax(copied_analyzed_row[40:])
-                x0_1 = np.argmax(copied_analyzed_row[:40])
-                x0_2 = np.argmax(copied_analyzed_row[40:])+40
-                gamma_1 = None
-                gamma_2 = None
-                for i in xrange(40 - x0_1): 
-                    half_max = constant_1/2
-                    if copied_analyzed_row[:40][x0_1+i] <= half_max:
-                        gamma_1 = i*2
-                        break
-                for j in xrange(40 - (x0_2 - 40)):
-                    half_max = constant_2/2
-                    if copied_analyzed_row[40:][x0_2 - 40+j] <= half_max:
-                        gamma_2 = j*2
-                        break
-
-                delta_peaks = x0_2 - x0_1
-                BS = (self.FSR.get() - delta_peaks*self.SD.get())/2
-                length_bs = len(self.brillouin_shift_list)
-                if length_bs >= 100:
-                    self.brillouin_shift_list = []
-                self.brillouin_shift_list.append(BS)
-                length_bs +=1
-
-                
-                if gamma_1 is not None and gamma_2 is not None:
-                    popt, pcov = curve_fit(lorentzian, self.graph.x_axis, copied_analyzed_row, p0 = np.array([gamma_1, x0_1, constant_1, gamma_2, x0_2, constant_2, 100]))
-                    self.queue.put(("plot",popt.copy()))
-                    #subplot.plot(self.graph.x_axis, lorentzian(self.graph.x_axis, *popt), 'r-', label='fit')
-               
-            else:
-                constant_1 = np.amax(copied_analyzed_row[:20])
-                constant_2 = np.amax(copied_analyzed_row[20:40])
-                constant_3 = np.amax(copied_analyzed_row[40:60])
-                constant_4 = np.amax(copied_analyzed_row[60:])
-                constant_5 = 100
-
-
-                x0_1 = np.argmax(copied_analyzed_row[:20])
-                x0_2 = np.argmax(copied_analyzed_row[20:40])+20
-                x0_3 = np.argmax(copied_analyzed_row[40:60])+40
-                x0_4 = np.argmax(copied_analyzed_row[60:])+60
-
-
-
-                popt, pcov = curve_fit(lorentzian_reference, self.graph.x_axis, copied_analyzed_row, p0 = np.array([1, x0_1, constant_1, 1, x0_2, constant_2, 1, x0_3, constant_3, 1, x0_4, constant_4, constant_5]))
-                self.queue.put(("plot",popt.copy()))
-                #subplot.plot(self.graph.x_axis, lorentzian_reference(self.graph.x_axis, *popt), 'r-', label='fit')
-                measured_SD = (2*self.PlasticBS - 2*self.WaterBS) / ((x0_4 - x0_1) + (x0_3 - x0_2))
-                measured_FSR = 2*self.PlasticBS - measured_SD*(x0_3 - x0_2)
-                self.SD.set(measured_SD)
-                self.FSR.set(measured_FSR)
-
-        except Exception as e:
-            print "Error is: ",str(e)
-            print "Stack trace: ", traceback.format_exc()
-            pass
+        if result["reference"]:
+            self.SD.set(result["SD"])
+            self.FSR.set(result["FSR"])
+        else:
+            self.shift_history.append(result["shift"], result["timestamp"], seq, result["shift_error"], result["fit"])
+            self.shift_label_var.set("BS: %.4f +/- %.4f  mean: %.4f std: %.4f" % (result["shift"], result["shift_error"], self.shift_history.mean, self.shift_history.std))
 
+        self.display.post("graph",(self.analyzed_row,result["fit"]))
 
-        self.queue.put(("scatter",(copied_analyzed_row.copy(),self.brillouin_shift_list[:])))
-        #subplot.scatter(self.graph.x_axis, copied_analyzed_row, s = 1)
-        #brillouin_plot.scatter(np.arange(1, len(self.brillouin_shift_list)+1), np.array(self.brillouin_shift_list))
 
+    # runs a motor command for a Tk button; while a scan is running (or the motor is
+    # otherwise busy) the button does nothing instead of freezing the GUI until it is done
+    def gui_motor(self, command, *args):
+        if self.scan_engine.current is not None or self.motor_lock.locked():
+            print "motor busy, wait for the scan to finish or abort it"
+            return
+        command(*args)
 
     # moves zaber motor to home position
     def move_motor_home(self):
-        self.motor.device.home()
-        loc = self.motor.device.send(60,0)
+        with self.motor_lock:
+            self.motor.device.home()
+            loc = self.motor.device.send(60,0)
         self.location_var.set(int(loc.data*3.072))
 
     # moves zaber motor, called on by forwards and backwards buttons
     def move_motor_relative(self, distance):
-        self.motor.device.move_rel(int(distance/3.072))
-        loc = self.motor.device.send(60, 0)
+        with self.motor_lock:
+            self.motor.device.move_rel(int(distance/3.072))
+            loc = self.motor.device.send(60, 0)
         self.location_var.set(int(loc.data*3.072))
 
-     # moves zaber motor to a set location, called on above
+     # moves zaber motor to a set location, called on above, returns the location reached
     def move_motor_abs(self, location):
-        self.motor.device.move_abs(int(location/3.072))
-        loc = self.motor.device.send(60, 0)
+        with self.motor_lock:
+            self.motor.device.move_abs(int(location/3.072))
+            loc = self.motor.device.send(60, 0)
         self.location_var.set(int(loc.data*3.072))
+        return loc.data*3.072
 
+    # returns False without sending anything for velocities the motor cannot move at
     def set_velocity(self, velocity):
-        self.motor.device.send(42,velocity)
-
+        if velocity <= 0:
+            print "velocity must be above 0"
+            return False
+        with self.motor_lock:
+            self.motor.device.send(42,velocity)
+        return True
+
+    # motor speed in um/s: the velocity entry or, when that is 0, the speed setting read back
+    # from the motor; None if the motor is busy and cannot be asked without waiting
+    def motor_velocity(self):
+        speed = self.velocity_var.get()
+        if speed <= 0:
+            if not self.motor_lock.acquire(False):
+                return None
+            try:
+                # return setting (53) of set target speed (42)
+                speed = self.motor.device.send(53, 42).data
+            finally:
+                self.motor_lock.release()
+        # zaber speed data is microsteps/s * 1.6384
+        return speed/1.6384*3.072
+
+    # queues a scan over the points of build_plan on the scan engine, with the estimated
+    # duration shown in the scan panel, or sweeps from start_pos over length
     def slice_routine(self, start_pos, length, num_steps):
-        self.move_motor_abs(start_pos)
-        step_size = length // num_steps
-        imlist = []
-        for i in range(num_steps):
-            self.condition.acquire()
-            #print "slice_routine acquired lock"
-
-            self.move_motor_relative(step_size)            
-            #print "moving.. "
-            print self.location_var.get()
+        if self.scan_sweep.get() == 1:
+            if self.velocity_var.get() <= 0:
+                print "enter a velocity above 0 for a sweep"
+                return
+            # frames are taken back to back while sweeping
+            self.continuous.set(1)
+            self.scan_paused.set(0)
+            self.scan_engine.submit_sweep(start_pos, start_pos + length)
+            return
+        if num_steps <= 0 and not self.scan_positions.get().strip():
+            return
+        if self.scan_adaptive.get() == 1:
+            self.scan_paused.set(0)
+            self.adaptive_scan = adaptive_scan.AdaptiveScan(self.scan_engine, start_pos, length, max(num_steps, 2),
+                                                            self.scan_budget.get()).start()
+            return
+        plan = self.build_plan(start_pos, length, num_steps)
+        if not plan:
+            return
+        plan = scan_plan.repeat(plan, max(self.scan_passes.get(), 1))
+        if self.scan_reference_every.get() > 0:
+            plan = scan_plan.interleave_reference(plan, self.scan_reference_every.get())
+
+        velocity = self.motor_velocity()
+        duration = None
+        if velocity is not None and velocity > 0:
+            duration = scan_plan.estimate(plan, velocity, self.scan_acceleration, self.location_var.get(), frame = self.andor.frame_time())
+            print "scan plan:",scan_plan.summary(plan),"estimated",round(duration, 1),"s"
+        self.scan_paused.set(0)
+        self.scan_engine.submit(plan, estimate = duration)
+
+    # sample points of a scan: the positions typed in, in nearest neighbour order from the current
+    # position, a serpentine grid when there are lateral steps, or num_steps frames along length
+    def build_plan(self, start_pos, length, num_steps):
+        if self.scan_positions.get().strip():
+            try:
+                positions = [float(p) for p in self.scan_positions.get().replace(",", " ").split()]
+            except ValueError:
+                print "positions must be numbers separated by commas or spaces"
+                return None
+            return scan_plan.nearest_neighbour(scan_plan.points(positions), self.location_var.get())
+        if self.scan_lateral_steps.get() > 1:
+            if self.motor_axes < 2:
+                print "lateral scans need a second motor axis"
+                return None
+            with self.motor_lock:
+                lateral_start = self.motor.devices[1].send(60, 0).data*3.072
+            return scan_plan.grid([start_pos, lateral_start], [length, self.scan_lateral_length.get()],
+                                  [num_steps, self.scan_lateral_steps.get()])
+        return scan_plan.line(start_pos, length, num_steps)
+
+    # moves to a scan_plan.ScanPoint (or a plain position for sweeps) and switches the shutters
+    # for reference points, returns the position reached
+    def scan_move(self, point):
+        if not isinstance(point, scan_plan.ScanPoint):
+            return self.move_motor_abs(point)
+
+        with self.lock:
+            reference = self.shutter_state.get() == 1
+        if point.reference != reference:
+            self.shutter_state.set(1 if point.reference else 0)
+            self.shutters()
+        if point.position is None:
+            return None
+        if len(point.position) == 1:
+            return self.move_motor_abs(point.position[0])
+        with self.motor_lock:
+            reached = self.motor.move_abs_axes([int(p/3.072) for p in point.position])
+        self.location_var.set(int(reached[0]*3.072))
+        return tuple(p*3.072 for p in reached)
+
+    # waits for the andor thread to hand over a frame exposed after this call
+    def scan_acquire(self, scan):
+        with self.condition:
+            self.scan_request_time = time.time()
             self.scan_ready = True
-            #print "waiting.."
-            self.condition.wait()
+            while self.scan_ready:
+                self.condition.wait(0.5)
+                if scan.aborted:
+                    self.scan_ready = False
+                    scan.check()
+            return self.andor_export_image
+
+    # moves to end at the velocity entered in the GUI while the andor thread keeps every frame,
+    # returns [(frame, position)] with the positions interpolated from the polled motor positions
+    def scan_sweep_frames(self, scan, end):
+        if not self.set_velocity(self.velocity_var.get()):
+            raise ValueError("sweeps need a velocity above 0")
+        # zaber speed data is microsteps/s * 1.6384; a move taking much longer than expected lost a reply
+        velocity = self.velocity_var.get()/1.6384*3.072
+        timeout = 2*scan_plan.move_time(end - self.location_var.get(), velocity, self.scan_acceleration) + 10
+        with self.sweep_lock:
+            self.sweep_frames = []
+        try:
+            with self.motor_lock:
+                self.motor.start_move_abs(int(end/3.072))
+                samples = self.motor.track_move(stop = lambda: scan.aborted, timeout = timeout)
+        finally:
+            with self.sweep_lock:
+                frames = self.sweep_frames
+                self.sweep_frames = None
+        sample_times, sample_positions = np.array(samples, dtype = np.float64).T
+        self.location_var.set(int(sample_positions[-1]*3.072))
+
+        # frames are stamped when they are read out, the middle of the exposure is about
+        # half a kinetic cycle earlier; frames outside the polled interval are not part of the sweep
+        times = np.array([timestamp for timestamp, frame in frames]) - self.andor.cycle_time/2
+        positions = np.interp(times, sample_times, sample_positions)*3.072
+        inside = (times >= sample_times[0]) & (times <= sample_times[-1])
+        print "sweep took",sample_times[-1] - sample_times[0],"s,",inside.sum(),"frames"
+        return [(frames[i][1], positions[i]) for i in np.nonzero(inside)[0]]
+
+    # runs on the scan engine's export thread while the motor moves on: every slice is
+    # fitted and written with its raw 16 bit frame to the scan's chunked container
+    def scan_store(self, scan, index, position, frame):
+        proper_image, seq, job, readout = frame
+        print "scan step",index,"at",position
+        writer = self.scan_writers.get(scan)
+        if writer is None:
+            ts = datetime.datetime.now()
+            # the passes of an adaptive scan can start within the same second
+            path = os.path.join("data_acquisition", "scan_{}_{}".format(ts.strftime("%Y-%m-%d_%H-%M-%S"), scan.name))
+            writer = scan_writer.ScanWriter(path, metadata = {"name": scan.name, "positions": scan.positions, "continuous": scan.continuous})
+            self.scan_writers[scan] = writer
 
-            imlist.append(self.andor_export_image)
-            #print "adding images.."
+        try:
+            job = dict(job, fit = True)
+            result = spectrum_analysis.analyze_frame(proper_image, **job)
+        except Exception:
+            print "Error analyzing scan slice ",index
+            print "Stack trace: ", traceback.format_exc()
+            result = {"shift": None, "shift_error": None, "fit": None}
+        writer.append(proper_image, seq, position, job["timestamp"], int(job["reference"]),
+                      result["shift"], result["shift_error"], result["fit"], readout)
+        # (position along the first axis, shift, shift error) of the sample slices, for adaptive scans
+        if position is not None and not job["reference"]:
+            scan.results.append((np.atleast_1d(position)[0],
+                                 np.nan if result["shift"] is None else result["shift"],
+                                 np.nan if result["shift_error"] is None else result["shift_error"]))
+
+    def scan_finish(self, scan):
+        writer = self.scan_writers.pop(scan, None)
+        if writer is not None:
+            writer.close()
+            print "wrote",writer.count,"slices to",writer.path
+        # back to the sample arm after reference points
+        if any(isinstance(point, scan_plan.ScanPoint) and point.reference for point in scan.positions):
+            self.shutter_state.set(0)
+            self.shutters()
+
+    def pause_scan(self):
+        scan = self.scan_engine.current
+        if scan is None:
+            self.scan_paused.set(0)
+        elif self.scan_paused.get() == 1:
+            scan.pause()
+        else:
+            scan.resume()
+
+    def abort_scan(self):
+        if self.adaptive_scan is not None:
+            self.adaptive_scan.abort()
+        self.scan_engine.abort_all()
+        self.scan_paused.set(0)
+
+    # called from the scan engine thread
+    def scan_event(self, scan, event):
+        if scan.error is not None and event == scan_engine.FAILED:
+            print "Scan failed"
+            print "Stack trace: ", scan.error
+        self.display.post("scan", (scan.state, scan.index, len(scan), scan.estimate))
+
+    def show_scan(self, item):
+        state, index, steps, estimate = item
+        if estimate is None:
+            self.scan_label_var.set("Scan %s: %d/%d" % (state, index, steps))
+        else:
+            self.scan_label_var.set("Scan %s: %d/%d, est. %d s" % (state, index, steps, round(estimate)))
 
-        print "length of imlist: ",len(imlist)
-        # Save images to tif file 
-        if len(imlist) != 0:
-            imlist[0].save("data_acquisition/scan.tif",compression="tiff_deflate",save_all=True,append_images=imlist[1:]) 
-            print "finished exporting as tif"
+    # called by the pupil detector menu, the switch is made by videoLoop before its next frame
+    def set_detector(self, name):
+        self.requested_detector = name
 
     def takeSnapshot(self):
         # grab the current timestamp and use it to construct the
@@ -556,46 +943,25 @@ class App(threading.Thread):
         filename = "{}.jpg".format(ts.strftime("%Y-%m-%d_%H-%M-%S"))
         p = os.path.sep.join((self.outputPath, filename))
  
-        # save the file
-
-        cv2.imwrite(p, self.image.copy())
-
-        print("[INFO] saved {}".format(filename))
+        # the file is saved by videoLoop while it still holds the next frame
+        self.snapshot_path = p
 
+    # mono frames are written in the background and videoLoop logs the pupil of every frame while recording,
+    # the annotated video is made afterwards with pupil_recorder.export
     def triggerRecord(self):
-        if self.record.get() == 0:
-            with self.record_lock:
-
-                written_video_frames = 0
-                pupil_video_writer = skv.FFmpegWriter('data_acquisition/pupil_video.avi',outputdict={
-                '-vcodec':'libx264',
-                '-b':'30000000',
-                '-vf':'setpts=4*PTS'
-                })
-
-                for frame in self.pupil_video_frames:
-                    pupil_video_writer.writeFrame(frame)
-                    written_video_frames += 1
-                    print "wrote a frame!"
-                
-                print "finished writing!"
-                pupil_video_writer.close()
-                self.pupil_video_frames = []
-
-        
-                frame_number = 0
-                pupil_data_file = open('data_acquisition/pupil_data.txt','w+')
-
-                for frame_number in range(1,len(self.pupil_data_list)+1):
-                    pupil_center, pupil_radius = self.pupil_data_list[frame_number-1]
-                    if pupil_center is None or pupil_radius is None: 
-                        pupil_data_file.write("Frame: %d No pupil detected!\n" % frame_number)
-                    else: 
-                        pupil_data_file.write("Frame: %d Pupil Center: %s Pupil Radius: %d\n" % (frame_number,pupil_center,pupil_radius))
-
-                print "video frames vs data frames",written_video_frames,frame_number
-                pupil_data_file.close()
-                self.pupil_data_list = []
+        if self.record.get() == 1:
+            # every recording gets its own files, the previous writer may still be flushing
+            ts = datetime.datetime.now()
+            path = os.path.join("data_acquisition", "pupil_recording_{}".format(ts.strftime("%Y-%m-%d_%H-%M-%S-%f")))
+            recorder = pupil_recorder.PupilRecorder(path)
+            recorder.start()
+            print "pupil recording to",path
+            self.recorder = recorder
+        else:
+            recorder = self.recorder
+            self.recorder = None
+            if recorder is not None:
+                recorder.stop()
 
 
     def onClick(self,event):
@@ -612,11 +978,18 @@ class App(threading.Thread):
     # release connections to devices, closes application
     def onClose(self):
         self.stopEvent.set()
-        self.mako.camera.runFeatureCommand('AcquisitionStop')
-        self.mako.camera.endCapture()
-        self.mako.camera.revokeAllFrames()
+        self.display.stop()
+        for name, (posted, shown, dropped, errors) in sorted(self.display.stats().items()):
+            print name,"posted:",posted,"shown:",shown,"dropped:",dropped,"errors:",errors
+        delivered, dropped, incomplete, held = self.mako_capture.stats()
+        print "pupil camera delivered:",delivered,"dropped:",dropped,"incomplete:",incomplete
+        self.mako_capture.close()
+        if self.recorder is not None:
+            self.recorder.stop(wait = True)
         self.mako.vimba.shutdown()
+        self.scan_engine.stop()
         self.motor.port.close()
+        self.analysis.close()
         self.shutters(close = True)
         self.root.quit()
         self.root.destroy()
@@ -624,28 +997,81 @@ class App(threading.Thread):
 
 
 
+#live plots of the analyzed spectrum, its fit and the brillouin shift history
+#artists are created once and only their data is replaced, the static parts of
+#the figure are cached and the artists are blitted on top of them
 class Graph(object):
     def __init__(self):
         self.fig = Figure(figsize = (10, 10), dpi = 100)
         self.x_axis = np.arange(1,81)
-
-def lorentzian(x, gamma_1, x0_1, constant_1, gamma_2, x0_2, constant_2, constant_3):
-    numerator_1 = 0.5*gamma_1*constant_1
-    denominator_1 = math.pi * (x - x0_1) **2 + (0.5 * gamma_1)**2
-    numerator_2 = 0.5*gamma_2*constant_2
-    denominator_2 = math.pi * (x - x0_2) **2 + (0.5 * gamma_2)**2
-    y = (numerator_1/denominator_1) + (numerator_2/denominator_2) + constant_3
-    return y
-
-def lorentzian_reference(x, gamma_1, x0_1, constant_1, gamma_2, x0_2, constant_2, gamma_3, x0_3, constant_3, gamma_4, x0_4, constant_4, constant_5):
-    numerator_1 = 0.5*gamma_1*constant_1
-    denominator_1 = math.pi * (x - x0_1) **2 + (0.5 * gamma_1)**2
-    numerator_2 = 0.5*gamma_2*constant_2
-    denominator_2 = math.pi * (x - x0_2) **2 + (0.5 * gamma_2)**2
-    numerator_3 = 0.5*gamma_3*constant_3
-    denominator_3 = math.pi * (x - x0_3) **2 + (0.5 * gamma_3)**2
-    numerator_4 = 0.5*gamma_4*constant_4
-    denominator_4 = math.pi * (x - x0_4) **2 + (0.5 * gamma_4)**2
-    y = (numerator_1/denominator_1) + (numerator_2/denominator_2) + (numerator_3/denominator_3) + (numerator_4/denominator_4) + constant_5
-    return y
-        
+        self.fit_axis = np.linspace(1, 80, 400)
+
+        self.subplot = self.fig.add_subplot(211)
+        self.subplot.set_xlabel("Pixel")
+        self.subplot.set_ylabel("Counts")
+        self.brillouin_plot = self.fig.add_subplot(212)
+        self.brillouin_plot.set_xlabel("Frame")
+        self.brillouin_plot.set_ylabel("Brillouin shift (GHz)")
+
+        self.spectrum_line, = self.subplot.plot([], [], 'b.', markersize = 2, animated = True)
+        self.fit_line, = self.subplot.plot([], [], 'r-', animated = True)
+        self.shift_points, = self.brillouin_plot.plot([], [], 'b.', markersize = 3, animated = True)
+
+        self.canvas = None
+        self.backgrounds = None
+        self.needs_draw = True
+
+    def attach(self, canvas):
+        self.canvas = canvas
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    #a full draw happened (resize, rescale), cache the static background of both plots
+    def on_draw(self, event):
+        self.backgrounds = [self.canvas.copy_from_bbox(ax.bbox) for ax in (self.subplot, self.brillouin_plot)]
+        self.draw_artists()
+
+    def update_spectrum(self, row):
+        self.spectrum_line.set_data(self.x_axis[:len(row)], row)
+        self.autoscale(self.subplot, self.x_axis[:len(row)], row)
+
+    #popt is None when the frame was not fitted
+    def update_fit(self, popt):
+        if popt is None:
+            self.fit_line.set_data([], [])
+        else:
+            self.fit_line.set_data(self.fit_axis, lf.lorentzian_peaks(self.fit_axis, popt)[0])
+
+    def update_shifts(self, x, y):
+        self.shift_points.set_data(x, y)
+        self.autoscale(self.brillouin_plot, x, y)
+
+    #only changes the limits, which needs a full redraw, when the data left them or shrank a lot
+    def autoscale(self, ax, x, y):
+        if len(x) == 0:
+            return
+        for data, get_lim, set_lim in ((x, ax.get_xlim, ax.set_xlim), (y, ax.get_ylim, ax.set_ylim)):
+            low, high = np.nanmin(data), np.nanmax(data)
+            if not np.isfinite(low) or not np.isfinite(high):
+                continue
+            lim_low, lim_high = get_lim()
+            span = max(high - low, 1e-3*abs(high), 1e-6)
+            if low < lim_low or high > lim_high or span < 0.25*(lim_high - lim_low):
+                set_lim(low - 0.1*span, high + 0.1*span)
+                self.needs_draw = True
+
+    def draw_artists(self):
+        self.subplot.draw_artist(self.spectrum_line)
+        self.subplot.draw_artist(self.fit_line)
+        self.brillouin_plot.draw_artist(self.shift_points)
+
+    def redraw(self):
+        if self.needs_draw or self.backgrounds is None:
+            self.needs_draw = False
+            #on_draw caches the new backgrounds and draws the artists
+            self.canvas.draw()
+            return
+        for background in self.backgrounds:
+            self.canvas.restore_region(background)
+        self.draw_artists()
+        self.canvas.blit(self.subplot.bbox)
+        self.canvas.blit(self.brillouin_plot.bbox)
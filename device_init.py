@@ -1,5 +1,6 @@
 
 import time
+from ctypes import c_ulong, c_long, c_int, c_float, byref
 
 from pymba import *
 from my_andor.andor_wrap import *
@@ -14,10 +15,17 @@ class Andor_Camera(object):
         self.set_up()
 
     def set_up(self):
+        self.hbin = 1
+        self.vbin = 4
+        # kinetic cycle time in seconds while running continuously, 0 for single scans
+        self.cycle_time = 0
         self.cam.SetReadMode(4)
         self.cam.SetAcquisitionMode(1)
         self.cam.SetTriggerMode(0)
-        self.cam.SetImage(1,4,1,self.cam.width,1,self.cam.height)
+        self.cam.SetImage(self.hbin,self.vbin,1,self.cam.width,1,self.cam.height)
+        # (rows, columns) of the frames the camera returns with the above binning
+        self.frame_shape = (self.cam.height // self.vbin, self.cam.width // self.hbin)
+        self.readout = self.readout_geometry()
         self.cam.SetShutter(1,1,0,0)
         self.cam.SetExposureTime(.3)
         self.cam.SetTemperature(-80)
@@ -45,6 +53,90 @@ class Andor_Camera(object):
 
         self.cam.SetEMAdvanced(1)
         self.cam.SetEMCCDGain(300)
+        self.update_single_time()
+
+    # reads out only roi (a spectral_roi.SpectralROI) with all of its rows binned
+    # on chip into one, or the full binned sensor again when roi is None
+    def set_readout(self, roi=None):
+        if roi is None:
+            self.cam.SetImage(self.hbin,self.vbin,1,self.cam.width,1,self.cam.height)
+            self.frame_shape = (self.cam.height // self.vbin, self.cam.width // self.hbin)
+        else:
+            rows = roi.row_end - roi.row_start + 1
+            self.cam.SetImage(roi.hbin,rows,roi.col_start,roi.col_end,roi.row_start,roi.row_end)
+            self.frame_shape = roi.shape
+        self.readout = self.readout_geometry(roi)
+        self.update_single_time()
+
+    # sensor area and binning of the frames read out with roi (None for the full sensor),
+    # saved with recorded frames; rows and columns are 1-based and inclusive
+    def readout_geometry(self, roi=None):
+        if roi is None:
+            return {"roi": False, "rows": [1, self.cam.height], "columns": [1, self.cam.width],
+                    "hbin": self.hbin, "vbin": self.vbin}
+        return {"roi": True, "rows": [roi.row_start, roi.row_end], "columns": [roi.col_start, roi.col_end],
+                "hbin": roi.hbin, "vbin": roi.row_end - roi.row_start + 1}
+
+    # (exposure, accumulate cycle, kinetic cycle) times in seconds the camera actually uses
+    def acquisition_timings(self):
+        exposure = c_float()
+        accumulate = c_float()
+        kinetic = c_float()
+        self.cam.dll.GetAcquisitionTimings(byref(exposure), byref(accumulate), byref(kinetic))
+        return exposure.value, accumulate.value, kinetic.value
+
+    # seconds per single scan frame for the current exposure and readout, kept so
+    # frame_time() never has to ask the camera while it is acquiring
+    def update_single_time(self):
+        exposure, accumulate, kinetic = self.acquisition_timings()
+        self.single_time = max(exposure, kinetic)
+
+    # seconds per frame in the current acquisition mode
+    def frame_time(self):
+        if self.cycle_time > 0:
+            return self.cycle_time
+        return self.single_time
+
+    # copies the last acquired frame straight into slot of a frame_ring.FrameRing,
+    # bypassing the python list that Andor.GetAcquiredData builds
+    def acquire_into(self, ring, slot):
+        size = self.frame_shape[0]*self.frame_shape[1]
+        error = self.cam.dll.GetAcquiredData16(ring.pointer(slot), c_ulong(size))
+        return ERROR_CODE[error]
+
+    # run till abort: the camera keeps exposing into its circular buffer until
+    # stop_continuous, frames are taken out with new_images/image_into
+    def start_continuous(self):
+        self.cam.SetAcquisitionMode(5)
+        self.cam.dll.SetKineticCycleTime(c_float(0))
+        self.cycle_time = self.acquisition_timings()[2]
+        return ERROR_CODE[self.cam.dll.StartAcquisition()]
+
+    def stop_continuous(self):
+        self.cam.dll.AbortAcquisition()
+        self.cam.SetAcquisitionMode(1)
+        self.cycle_time = 0
+
+    # blocks until a new image is in the circular buffer or timeout (ms) runs out
+    def wait_for_image(self, timeout=1000):
+        return ERROR_CODE[self.cam.dll.WaitForAcquisitionTimeOut(c_int(timeout))] == "DRV_SUCCESS"
+
+    # (first, last) indices of the images not yet read from the circular buffer, or None
+    def new_images(self):
+        first = c_long()
+        last = c_long()
+        error = self.cam.dll.GetNumberNewImages(byref(first), byref(last))
+        if ERROR_CODE[error] != "DRV_SUCCESS":
+            return None
+        return first.value, last.value
+
+    # copies image index of the circular buffer into slot of a frame_ring.FrameRing
+    def image_into(self, index, ring, slot):
+        size = self.frame_shape[0]*self.frame_shape[1]
+        valid_first = c_long()
+        valid_last = c_long()
+        error = self.cam.dll.GetImages16(c_long(index), c_long(index), ring.pointer(slot), c_ulong(size), byref(valid_first), byref(valid_last))
+        return ERROR_CODE[error]
 
 
 # class for CMOS camera
@@ -71,11 +163,14 @@ class Mako_Camera(object):
 
 
 class Motor(object):
-    def __init__(self):
+    # axes are the zaber devices 1 to axes daisy chained on the same port
+    def __init__(self, axes = 1):
         self.port = zs.BinarySerial("COM11", timeout = 20, inter_char_timeout = 0.05)
-        self.device = zs.BinaryDevice(self.port, 1)
-        self.device.home()
-        self.device.send(37,64)
+        self.devices = [zs.BinaryDevice(self.port, number) for number in range(1, axes + 1)]
+        self.device = self.devices[0]
+        for device in self.devices:
+            device.home()
+            device.send(37,64)
 
         """
         reply = self.port.read()
@@ -83,3 +178,60 @@ class Motor(object):
             print("An error occurred in device {}. Error code: {}".format(
                     reply.device_number, reply.data))
         """
+
+    # moves the first len(positions) axes to positions (device units) at the same time,
+    # returns the positions reached
+    def move_abs_axes(self, positions):
+        devices = self.devices[:len(positions)]
+        for device, position in zip(devices, positions):
+            self.port.write(zs.BinaryCommand(device.number, 20, int(position)))
+        reached = {}
+        while len(reached) < len(devices):
+            reply = self.port.read()
+            if reply.command_number == 255:
+                raise RuntimeError("Zaber error {} on device {}".format(reply.data, reply.device_number))
+            reached[reply.device_number] = reply.data
+        return [reached[device.number] for device in devices]
+
+    # starts a move to position (device units) without waiting for it to finish,
+    # the reply to the move is read by track_move
+    def start_move_abs(self, position):
+        self.port.write(zs.BinaryCommand(1, 20, position))
+
+    # polls the position (command 60) until the move started by start_move_abs
+    # finishes, returns [(host time, position)] ending with the final position;
+    # the move is stopped (command 23) as soon as stop() returns True, or with a
+    # RuntimeError when it has not finished after timeout seconds
+    def track_move(self, interval = 0.005, stop = None, timeout = None):
+        deadline = None if timeout is None else time.time() + timeout
+        samples = []
+        while True:
+            expired = deadline is not None and time.time() > deadline
+            if expired or (stop is not None and stop()):
+                self.port.write(zs.BinaryCommand(1, 23))
+                # the replies to the last move and position request may still come first
+                for attempt in range(4):
+                    reply = self.port.read()
+                    if reply.command_number == 23:
+                        samples.append((time.time(), reply.data))
+                        break
+                else:
+                    raise RuntimeError("Zaber did not answer the stop command")
+                if expired:
+                    raise RuntimeError("move did not finish within {} s".format(timeout))
+                return samples
+
+            sent = time.time()
+            self.port.write(zs.BinaryCommand(1, 60))
+            reply = self.port.read()
+            received = time.time()
+            if reply.command_number == 255:
+                raise RuntimeError("Zaber error {}".format(reply.data))
+            if reply.command_number == 20:
+                # the move finished, the position request is still answered
+                samples.append((received, reply.data))
+                self.port.read()
+                return samples
+            # the position was read somewhere between sending and receiving
+            samples.append(((sent + received)/2, reply.data))
+            time.sleep(interval)
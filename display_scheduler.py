@@ -0,0 +1,107 @@
+
+import threading
+import time
+import traceback
+
+"""
+Hands data from the camera and analysis threads to the Tkinter thread.
+Every panel has a single "latest value wins" mailbox: producers overwrite
+whatever has not been shown yet (and it is counted as dropped), so memory
+stays bounded and the GUI never works through a backlog of stale frames.
+The Tk thread polls the mailboxes, and a panel is only refreshed when it is
+due according to its target frame rate; the (often expensive) conversion of
+the raw data for display only runs for items that are actually shown.
+"""
+
+
+class Mailbox(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.item = None
+        self.full = False
+        self.posted = 0
+        self.dropped = 0
+
+    def put(self, item):
+        with self.lock:
+            if self.full:
+                self.dropped += 1
+            self.item = item
+            self.full = True
+            self.posted += 1
+
+    # (True, item) if there is something new, (False, None) otherwise
+    def take(self):
+        with self.lock:
+            if not self.full:
+                return False, None
+            item = self.item
+            self.item = None
+            self.full = False
+            return True, item
+
+
+class Panel(object):
+    def __init__(self, show, fps, convert):
+        self.show = show
+        self.convert = convert
+        self.period = 1.0/fps if fps > 0 else 0
+        self.mailbox = Mailbox()
+        self.last_shown = 0
+        self.shown = 0
+        self.errors = 0
+
+
+class DisplayScheduler(object):
+    # interval is how often (ms) the Tk thread checks the mailboxes
+    def __init__(self, root, interval=10):
+        self.root = root
+        self.interval = interval
+        self.panels = {}
+        self.running = False
+
+    # show(item) updates the widget and convert(raw) prepares posted data for it,
+    # both are only ever called from the Tk thread
+    def add_panel(self, name, show, fps=30, convert=None):
+        self.panels[name] = Panel(show, fps, convert)
+
+    # can be called from any thread
+    def post(self, name, item):
+        self.panels[name].mailbox.put(item)
+
+    def set_fps(self, name, fps):
+        self.panels[name].period = 1.0/fps if fps > 0 else 0
+
+    def start(self):
+        self.running = True
+        self._update()
+
+    def stop(self):
+        self.running = False
+
+    def _update(self):
+        if not self.running:
+            return
+        now = time.time()
+        for name, panel in self.panels.items():
+            if now - panel.last_shown < panel.period:
+                continue
+            ready, item = panel.mailbox.take()
+            if not ready:
+                continue
+            panel.last_shown = now
+            try:
+                if panel.convert is not None:
+                    item = panel.convert(item)
+                panel.show(item)
+                panel.shown += 1
+            except Exception:
+                panel.errors += 1
+                print "Error updating panel ",name
+                print "Stack trace: ", traceback.format_exc()
+        self.root.after(self.interval, self._update)
+
+    # {name: (posted, shown, dropped, errors)}
+    def stats(self):
+        return dict((name, (panel.mailbox.posted, panel.shown, panel.mailbox.dropped, panel.errors))
+                    for name, panel in self.panels.items())
@@ -0,0 +1,69 @@
+
+import numpy as np
+import peak_finding
+
+"""
+Non-iterative Brillouin peak estimator for live alignment. Around each peak
+the reciprocal of a lorentzian, 1/(y - background), is a parabola in x, so a
+weighted linear least squares fit of a parabola to a few points on either
+side gives the center, height and width of the peak in closed form, together
+with an uncertainty from the fit residuals. Everything is vectorized over
+(N, W) batches of rows and all peaks at once.
+"""
+
+
+# center, height, fwhm and center standard deviation (all (N, n_peaks), pixel
+# index units) of the brightest peak in each of n_peaks equal segments
+def estimate_peaks(rows, n_peaks, half_width=3):
+    rows = np.atleast_2d(np.asarray(rows, dtype=np.float64))
+    n, w = rows.shape
+    bg = peak_finding.background(rows)
+    index = np.clip(peak_finding.segment_maxima(rows, n_peaks), half_width, w - 1 - half_width)
+
+    # (N, k, points) samples around each peak, x relative to the brightest pixel
+    offsets = np.arange(-half_width, half_width + 1)
+    signal = rows[np.arange(n)[:, None, None], index[:, :, None] + offsets] - bg[:, None, None]
+    floor = 1e-3*np.maximum(signal.max(axis=2, keepdims=True), 1)
+    signal = np.maximum(signal, floor)
+    z = 1.0/signal
+
+    # var(1/y) ~ var(y)/y**4, so weight every point by y**4
+    weight = signal**4
+    design = np.stack((offsets**2, offsets, np.ones_like(offsets)), axis=1).astype(np.float64)
+    normal = np.einsum('nkp,pi,pj->nkij', weight, design, design)
+    rhs = np.einsum('nkp,pi,nkp->nki', weight, design, z)
+    try:
+        inverse = np.linalg.inv(normal)
+    except np.linalg.LinAlgError:
+        inverse = np.linalg.pinv(normal)
+    coef = np.einsum('nkij,nkj->nki', inverse, rhs)
+    a, b, c = coef[..., 0], coef[..., 1], coef[..., 2]
+
+    # residual variance of the weighted fit scales the parameter covariance
+    residual = z - np.einsum('pi,nki->nkp', design, coef)
+    dof = max(len(offsets) - 3, 1)
+    covariance = inverse*((weight*residual**2).sum(axis=2)/dof)[..., None, None]
+
+    valid = a > 0
+    a = np.where(valid, a, np.nan)
+    shift = -b/(2*a)
+    z0 = c - b**2/(4*a)
+    height = 1.0/z0
+    width = 2*np.sqrt(z0/a)
+
+    # propagate the covariance of (a, b) to the center -b/(2a)
+    d_a = b/(2*a**2)
+    d_b = -1.0/(2*a)
+    variance = d_a**2*covariance[..., 0, 0] + 2*d_a*d_b*covariance[..., 0, 1] + d_b**2*covariance[..., 1, 1]
+
+    center = index + np.clip(shift, -half_width, half_width)
+    return center, height, width, np.sqrt(variance)
+
+
+# brillouin shift and its standard deviation for two peak sample rows, (N,) each
+def estimate_shift(rows, FSR, SD, half_width=3):
+    center, height, width, sigma = estimate_peaks(rows, 2, half_width)
+    delta_peaks = center[:, 1] - center[:, 0]
+    shift = (FSR - delta_peaks*SD)/2
+    shift_error = 0.5*SD*np.sqrt(sigma[:, 0]**2 + sigma[:, 1]**2)
+    return shift, shift_error, center, width
@@ -0,0 +1,55 @@
+
+import ctypes
+import Queue
+import numpy as np
+from multiprocessing.sharedctypes import RawArray
+
+"""
+Preallocated ring of uint16 EMCCD frame buffers. The memory is a single
+multiprocessing RawArray, allocated once, so the camera can write into it
+through a ctypes pointer, the acquisition thread and the analysis workers
+see it as numpy views and no frame is ever copied or re-allocated.
+
+A slot is claimed by the acquisition thread, filled by the camera, and
+released again once everybody downstream is done with it. When all slots are
+in use claim() blocks, which is the backpressure on acquisition.
+"""
+
+
+# numpy view of the whole ring, (slots, max_pixels)
+def attach(raw, slots):
+    return np.frombuffer(raw, dtype=np.uint16).reshape(slots, -1)
+
+
+class FrameRing(object):
+    def __init__(self, max_pixels, slots=8):
+        self.slots = slots
+        self.max_pixels = max_pixels
+        self.raw = RawArray(ctypes.c_uint16, slots*max_pixels)
+        self.buffer = attach(self.raw, slots)
+
+        # sequence number and host timestamp of the frame currently held by each slot,
+        # and the host time its exposure started
+        self.seq = np.zeros(slots, dtype=np.int64)
+        self.timestamp = np.zeros(slots, dtype=np.float64)
+        self.started = np.zeros(slots, dtype=np.float64)
+
+        self.free = Queue.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+
+    # returns the index of a free slot, raises Queue.Empty after timeout
+    def claim(self, timeout=None):
+        return self.free.get(True, timeout)
+
+    def release(self, slot):
+        self.free.put(slot)
+
+    # frame in slot as a (rows, columns) view
+    def view(self, slot, shape):
+        return self.buffer[slot, :shape[0]*shape[1]].reshape(shape)
+
+    # ctypes pointer to the start of slot, for the Andor SDK to write into
+    def pointer(self, slot):
+        address = ctypes.addressof(self.raw) + slot*self.max_pixels*ctypes.sizeof(ctypes.c_uint16)
+        return ctypes.cast(address, ctypes.POINTER(ctypes.c_uint16))
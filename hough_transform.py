@@ -52,17 +52,117 @@ def objective_function(center,radius,expected_center,expected_radius):
 
     return center_diff + 5*radius_diff
 
-        
-def detect_pupil_frame(frame,expected_radius=180,radius_range=15):
 
-    if frame is None: 
-        return
+# circle from cv2.HoughCircles closest to expected_radius, as (center, radius) or (None, None)
+def best_circle(circles,expected_radius):
+    if circles is None:
+        return None, None
+    best = min(circles[0,:], key=lambda c: abs(expected_radius - c[2]))
+    return (int(round(best[0])),int(round(best[1]))), int(round(best[2]))
 
-    frame_bgr = frame.copy()
 
-    frame = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY)
+# odd median blur kernel for an image downscaled by scale
+def blur_kernel(scale,full_kernel=15):
+    return max(3, int(full_kernel/scale) | 1)
 
-    frame = cv2.medianBlur(frame,15) #required for Hough transform
+
+class TrackingHoughDetector(object):
+    """
+    Hough pupil detection that tracks the pupil between frames. While the pupil
+    is tracked the blur and Hough transform only run on a window around the
+    last center and radius at full resolution. When tracking is lost the pupil
+    is first searched for on a downscaled image (scale times smaller), and every
+    max_misses failed frames the search is over the whole full resolution
+    frame instead, as detect_pupil_frame does.
+    """
+    def __init__(self,expected_radius=180,radius_range=15,scale=4,margin=1.5,max_misses=3,param2=700):
+        self.expected_radius = expected_radius
+        self.radius_range = radius_range
+        self.scale = scale
+        self.margin = margin
+        self.max_misses = max_misses
+        # accumulator threshold at full resolution, see detect_pupil_frame
+        self.param2 = param2
+
+        self.center = None
+        self.radius = None
+        self.misses = 0
+
+    def reset(self):
+        self.center = None
+        self.radius = None
+        self.misses = 0
+
+    def hough(self,gray,expected_radius,radius_range,scale=1):
+        blurred = cv2.medianBlur(gray,blur_kernel(scale))
+        circles = cv2.HoughCircles(blurred,cv2.HOUGH_GRADIENT,dp=3,minDist=max(blurred.shape[:2]),param1=1,param2=max(int(self.param2/scale),1),
+                                   minRadius=max(int(expected_radius-radius_range),1),maxRadius=int(expected_radius+radius_range))
+        return best_circle(circles,expected_radius)
+
+    # searches the downscaled frame, returns a full resolution (center, radius) guess
+    def coarse(self,gray):
+        small = gray
+        scale = 1
+        while scale < self.scale:
+            small = cv2.pyrDown(small)
+            scale *= 2
+        center, radius = self.hough(small,self.expected_radius/float(scale),self.radius_range/float(scale)+1,scale)
+        if center is None:
+            return None, None
+        return (center[0]*scale,center[1]*scale), radius*scale
+
+    # full resolution search in a window around center
+    def refine(self,gray,center,radius):
+        half = int(self.margin*(radius + self.radius_range))
+        x0 = max(center[0]-half,0)
+        y0 = max(center[1]-half,0)
+        window = gray[y0:center[1]+half, x0:center[0]+half]
+        if min(window.shape[:2]) < 2*(self.expected_radius - self.radius_range):
+            return None, None
+        found, found_radius = self.hough(window,self.expected_radius,self.radius_range)
+        if found is None:
+            return None, None
+        return (found[0]+x0,found[1]+y0), found_radius
+
+    # (center, radius) of the pupil in frame (gray or BGR), (None, None) if not found
+    def detect(self,frame):
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        if self.center is not None:
+            center, radius = self.refine(gray,self.center,self.radius)
+        elif self.misses > 0 and self.misses % self.max_misses == 0:
+            # the pyramid search keeps failing, try the whole frame once
+            center, radius = self.hough(gray,self.expected_radius,self.radius_range)
+        else:
+            center, radius = self.coarse(gray)
+            if center is not None:
+                center, radius = self.refine(gray,center,self.expected_radius)
+
+        if center is None:
+            self.misses += 1
+            if self.center is not None and self.misses >= self.max_misses:
+                self.reset()
+            return None, None
+
+        self.center = center
+        self.radius = radius
+        self.misses = 0
+        return center, radius
+
+
+# (center, radius, circles) of the pupil in the single channel uint8 frame gray,
+# only numbers are returned so the frame itself is never copied; circles are all
+# the Hough candidates (None with a tracker), center and radius are None if not found
+def find_pupil(gray,expected_radius=180,radius_range=15,tracker=None):
+
+    # a TrackingHoughDetector replaces the full frame Hough transform below
+    if tracker is not None:
+        tracker.expected_radius = expected_radius
+        tracker.radius_range = radius_range
+        min_circle_center, min_circle_radius = tracker.detect(gray)
+        return (min_circle_center,min_circle_radius,None)
+
+    frame = cv2.medianBlur(gray,15) #required for Hough transform
 
     """
     ## Parameters for cv2.HoughCircles() ##
@@ -77,39 +177,47 @@ def detect_pupil_frame(frame,expected_radius=180,radius_range=15):
     """
     circles = cv2.HoughCircles(frame,cv2.HOUGH_GRADIENT,dp=3,minDist=max(frame.shape[:2]),param1=1,param2=700,minRadius=expected_radius-radius_range,maxRadius=expected_radius+radius_range)
 
-    min_objective = float('inf')
-    min_circle_center = None
-    min_circle_radius = None
-    
-    # multiple circles are fine as long as we only draw in the one with smallest radius
-    if circles is not None: 
-        circles = np.uint16(np.around(circles))
-
-        for i in circles[0,:]:
-            cv2.circle(frame_bgr,(i[0],i[1]),i[2],(0,0,255),2)
-            cv2.circle(frame_bgr,(i[0],i[1]),2,(0,0,255),3)
+    # multiple circles are fine as long as we only use the one closest to the expected radius
+    min_circle_center, min_circle_radius = best_circle(circles,expected_radius)
+    if circles is not None:
+        circles = np.uint16(np.around(circles))[0,:]
+    #else: print "No circles detected!"
 
-            objective = abs(expected_radius - i[2])
+    return (min_circle_center,min_circle_radius,circles)
 
-            if objective < min_objective:
-                min_objective = objective
-                min_circle_center = (i[0],i[1])
-                min_circle_radius = i[2]
 
-        if min_circle_center is not None and min_circle_radius is not None:
-            cv2.circle(frame_bgr,min_circle_center,min_circle_radius,(255,0,0),2)
-            cv2.circle(frame_bgr,min_circle_center,2,(255,0,0),3)
-            #print "center:",min_circle_center,"radius:",min_circle_radius
-
-    else:
-        pass 
-        #print "No circles detected!"
+# draws the candidate circles in red and the pupil in blue onto the BGR image frame_bgr,
+# scale is the size of frame_bgr relative to the frame the detection ran on
+def draw_pupil(frame_bgr,center,radius,circles=None,scale=1.0):
+    if circles is not None:
+        for i in circles:
+            cv2.circle(frame_bgr,(int(i[0]*scale),int(i[1]*scale)),int(i[2]*scale),(0,0,255),2)
+            cv2.circle(frame_bgr,(int(i[0]*scale),int(i[1]*scale)),2,(0,0,255),3)
 
+    if center is not None and radius is not None:
+        center = (int(center[0]*scale),int(center[1]*scale))
+        cv2.circle(frame_bgr,center,int(radius*scale),(255,0,0),2)
+        cv2.circle(frame_bgr,center,2,(255,0,0),3)
+        #print "center:",center,"radius:",radius
 
     #cv2.line(frame_bgr,(0,0),(0,15),(0,0,0),5) # vertical line
     #cv2.line(frame_bgr,(0,0),(100,0),(255,255,255),5) # horizontal line
+    return frame_bgr
+
+
+# annotated copy of the BGR frame, kept for the offline viewer below; live code
+# should call find_pupil on the mono frame and only draw on what is displayed
+def detect_pupil_frame(frame,expected_radius=180,radius_range=15,tracker=None):
+
+    if frame is None: 
+        return
+
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    min_circle_center,min_circle_radius,circles = find_pupil(gray,expected_radius,radius_range,tracker)
 
-    return (frame_bgr.copy(),min_circle_center,min_circle_radius)
+    frame_bgr = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR) if frame.ndim == 2 else frame.copy()
+    draw_pupil(frame_bgr,min_circle_center,min_circle_radius,circles)
+    return (frame_bgr,min_circle_center,min_circle_radius)
 
 
 def detect_pupil_video(path,radius_range=None):
@@ -0,0 +1,165 @@
+
+import numpy as np
+import peak_finding
+
+"""
+Batched Levenberg-Marquardt fitting of the Lorentzian spectrum models used by
+app.py. Every peak has the form:
+
+    0.5*gamma*constant / (pi*(x - x0)**2 + (0.5*gamma)**2)
+
+and a spectrum is a sum of peaks plus a constant background. Parameters are
+laid out as [gamma_1, x0_1, constant_1, ..., gamma_k, x0_k, constant_k, offset],
+so the 2 peak sample model has 7 parameters and the 4 peak reference model
+has 13, the same order curve_fit was given in App.graphLoop.
+
+All spectra in a batch are fitted at once: the model, the analytic jacobian
+and the normal equations are evaluated for the whole (N, M) array and every
+spectrum keeps its own damping factor.
+"""
+
+SAMPLE_PEAKS = 2
+REFERENCE_PEAKS = 4
+
+# x axis used by App.graphLoop for the 80 pixel analyzed_row
+DEFAULT_X = np.arange(1, 81, dtype=np.float64)
+
+
+def num_params(n_peaks):
+    return 3*n_peaks + 1
+
+
+# parameters of the largest model, the reference fit; enough room for any fit vector
+N_PARAMS = num_params(REFERENCE_PEAKS)
+
+
+# splits a (N, P) parameter array into (N, k, 1) gamma, x0 and constant columns
+def _split(params):
+    peaks = params[:, :-1].reshape(params.shape[0], -1, 3)
+    return peaks[:, :, 0, None], peaks[:, :, 1, None], peaks[:, :, 2, None]
+
+
+# evaluates the summed lorentzians for every parameter row, returns (N, M)
+def lorentzian_peaks(x, params):
+    params = np.atleast_2d(params)
+    gamma, x0, constant = _split(params)
+    denominator = np.pi*(x - x0)**2 + (0.5*gamma)**2
+    y = (0.5*gamma*constant/denominator).sum(axis=1)
+    return y + params[:, -1, None]
+
+
+# analytic jacobian of lorentzian_peaks with respect to the parameters, (N, M, P)
+def lorentzian_jacobian(x, params):
+    params = np.atleast_2d(params)
+    n = params.shape[0]
+    gamma, x0, constant = _split(params)
+    dx = x - x0
+    denominator = np.pi*dx**2 + (0.5*gamma)**2
+    numerator = 0.5*gamma*constant
+    denominator_sq = denominator**2
+
+    d_gamma = 0.5*constant/denominator - numerator*0.5*gamma/denominator_sq
+    d_x0 = numerator*2*np.pi*dx/denominator_sq
+    d_constant = 0.5*gamma/denominator
+    peaks = np.stack((d_gamma, d_x0, d_constant), axis=2).reshape(n, -1, x.shape[-1])
+
+    jac = np.ones((n, x.shape[-1], peaks.shape[1] + 1))
+    jac[:, :, :-1] = peaks.transpose(0, 2, 1)
+    return jac
+
+
+# starting guess from the sub-pixel peak, height and fwhm of the brightest
+# peak in each of n_peaks equal segments (x0 is in x axis units)
+def initial_guess(rows, n_peaks, x=DEFAULT_X):
+    rows = np.atleast_2d(np.asarray(rows, dtype=np.float64))
+    position, height, width, bg = peak_finding.find_peaks(rows, n_peaks)
+    return guess_from_peaks(position, height, width, bg, x)
+
+
+# model parameters (N, P) for peaks at position (pixel index) with the given
+# height above background and fwhm. For this model the fwhm is gamma/sqrt(pi)
+# and the height 2*constant/gamma.
+def guess_from_peaks(position, height, width, bg, x=DEFAULT_X):
+    n, k = position.shape
+    gamma = np.sqrt(np.pi)*np.maximum(width, 1.0)
+    p0 = np.empty((n, num_params(k)))
+    p0[:, 0:-1:3] = gamma
+    p0[:, 1:-1:3] = np.interp(position, np.arange(len(x)), x)
+    p0[:, 2:-1:3] = 0.5*gamma*height
+    p0[:, -1] = bg
+    return p0
+
+
+def _solve(a, b):
+    try:
+        return np.linalg.solve(a, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        # at least one system is singular, fall back to the pseudo inverse for the batch
+        return np.einsum('npq,nq->np', np.linalg.pinv(a), b)
+
+
+# fits every row of rows (N, M) starting from p0 (N, P)
+# returns the fitted parameters (N, P) and a boolean convergence flag per row
+def fit_spectra(rows, p0, x=DEFAULT_X, max_iter=100, ftol=1e-10, xtol=1e-10, damping=1e-3):
+    y = np.atleast_2d(np.asarray(rows, dtype=np.float64))
+    params = np.array(np.atleast_2d(p0), dtype=np.float64)
+    x = np.asarray(x, dtype=np.float64)
+    n, p = params.shape
+    diagonal = np.arange(p)
+
+    residual = y - lorentzian_peaks(x, params)
+    cost = (residual**2).sum(axis=1)
+    lam = np.full(n, damping)
+    converged = np.zeros(n, dtype=bool)
+    active = np.isfinite(cost)
+
+    for _ in range(max_iter):
+        index = np.flatnonzero(active)
+        if index.size == 0:
+            break
+
+        jac = lorentzian_jacobian(x, params[index])
+        jtj = np.einsum('nmp,nmq->npq', jac, jac)
+        gradient = np.einsum('nmp,nm->np', jac, residual[index])
+
+        # marquardt scaling of the damping term by the curvature of each parameter
+        scale = jtj[:, diagonal, diagonal]
+        a = jtj.copy()
+        a[:, diagonal, diagonal] += lam[index, None]*np.maximum(scale, 1e-12)
+        step = _solve(a, gradient)
+
+        trial = params[index] + step
+        trial_residual = y[index] - lorentzian_peaks(x, trial)
+        trial_cost = (trial_residual**2).sum(axis=1)
+
+        small_step = np.sqrt((step**2).sum(axis=1)) <= xtol*(np.sqrt((params[index]**2).sum(axis=1)) + xtol)
+        better = np.isfinite(trial_cost) & (trial_cost < cost[index])
+        small_change = better & ((cost[index] - trial_cost) <= ftol*cost[index])
+
+        accepted = index[better]
+        params[accepted] = trial[better]
+        residual[accepted] = trial_residual[better]
+        cost[accepted] = trial_cost[better]
+        lam[accepted] /= 10.0
+        lam[index[~better]] *= 10.0
+
+        done = index[small_step | small_change]
+        converged[done] = True
+        active[done] = False
+        # damping blew up without finding a better step, give up on these rows
+        active[lam > 1e12] = False
+
+    return params, converged
+
+
+# convenience wrappers for the two models used in App.graphLoop
+def fit_sample(rows, p0=None, **kwargs):
+    if p0 is None:
+        p0 = initial_guess(rows, SAMPLE_PEAKS)
+    return fit_spectra(rows, p0, **kwargs)
+
+
+def fit_reference(rows, p0=None, **kwargs):
+    if p0 is None:
+        p0 = initial_guess(rows, REFERENCE_PEAKS)
+    return fit_spectra(rows, p0, **kwargs)
@@ -0,0 +1,138 @@
+import threading
+import time
+import Queue
+from collections import namedtuple
+from functools import partial
+
+import numpy as np
+
+"""
+Callback driven capture from the Mako pupil camera. Instead of a single frame
+that is requeued before its data is read, a ring of frames is announced and
+all of them are queued. Vimba calls back from its own thread whenever one is
+filled; the frame is handed to the consumer as a zero-copy numpy view on its
+buffer, together with the camera's frame id and hardware timestamp, and only
+goes back into the capture queue once the consumer releases it. Gaps in the
+frame ids count frames the camera could not deliver (e.g. because every
+buffer was still held by the consumer).
+"""
+
+# index of the buffer in the ring, camera frame id, camera timestamp (s),
+# host time of the callback (s) and the uint8 (height, width) view on the buffer
+MakoFrame = namedtuple("MakoFrame", ["index", "seq", "timestamp", "host_time", "image"])
+
+
+class MakoCapture(object):
+    def __init__(self, mako, buffers=8):
+        self.camera = mako.camera
+        self.buffers = buffers
+        self.frames = Queue.Queue()
+        self.running = False
+        self.lock = threading.Lock()
+
+        self.vimba_frames = []
+        self.images = []
+        self.callbacks = []
+        for index in range(buffers):
+            frame = self.camera.getFrame()
+            frame.announceFrame()
+            self.vimba_frames.append(frame)
+            # the buffer never moves, so the view is made once
+            self.images.append(np.ndarray(buffer = frame.getBufferByteData(),
+                                          dtype = np.uint8,
+                                          shape = (frame.height, frame.width)))
+            self.callbacks.append(partial(self._on_frame, index))
+
+        try:
+            self.tick_frequency = float(self.camera.GevTimestampTickFrequency)
+        except Exception:
+            # Mako cameras count nanoseconds
+            self.tick_frequency = 1e9
+        self.reset_counters()
+
+    def reset_counters(self):
+        with self.lock:
+            self.delivered = 0
+            # frames the camera skipped, from gaps in the frame ids
+            self.dropped = 0
+            # frames received with an error status, requeued right away
+            self.incomplete = 0
+            self.last_id = None
+            self.queued = 0
+
+    def start(self):
+        self.reset_counters()
+        self.running = True
+        self.camera.startCapture()
+        for index in range(self.buffers):
+            self._queue(index)
+        self.camera.runFeatureCommand('AcquisitionStart')
+
+    def stop(self):
+        self.running = False
+        self.camera.runFeatureCommand('AcquisitionStop')
+        self.camera.endCapture()
+        self.camera.flushCaptureQueue()
+        while not self.frames.empty():
+            self.frames.get()
+
+    # stops capturing and gives the buffers back to Vimba
+    def close(self):
+        if self.running:
+            self.stop()
+        self.camera.revokeAllFrames()
+
+    def _queue(self, index):
+        with self.lock:
+            self.queued += 1
+        self.vimba_frames[index].queueFrameCapture(self.callbacks[index])
+
+    # called from the Vimba thread
+    def _on_frame(self, index, frame):
+        host_time = time.time()
+        c_frame = frame._frame
+        with self.lock:
+            self.queued -= 1
+            if self.last_id is not None and c_frame.frameID > self.last_id + 1:
+                self.dropped += c_frame.frameID - self.last_id - 1
+            self.last_id = c_frame.frameID
+            if c_frame.receiveStatus != 0:
+                self.incomplete += 1
+            else:
+                self.delivered += 1
+        if not self.running:
+            return
+        if c_frame.receiveStatus != 0:
+            self._queue(index)
+            return
+        self.frames.put(MakoFrame(index, c_frame.frameID, c_frame.timestamp/self.tick_frequency,
+                                  host_time, self.images[index]))
+
+    # next MakoFrame in capture order, None after timeout seconds without one
+    def get(self, timeout=1.0):
+        try:
+            return self.frames.get(timeout = timeout)
+        except Queue.Empty:
+            return None
+
+    # the newest captured MakoFrame, older ones waiting in the queue are released
+    def get_latest(self, timeout=1.0):
+        frame = self.get(timeout)
+        while frame is not None:
+            try:
+                newer = self.frames.get_nowait()
+            except Queue.Empty:
+                return frame
+            self.release(frame)
+            frame = newer
+        return frame
+
+    # requeues the buffer of frame, its image must not be used afterwards
+    def release(self, frame):
+        if self.running:
+            self._queue(frame.index)
+
+    # (delivered, dropped, incomplete, buffers held by the consumer)
+    def stats(self):
+        with self.lock:
+            return self.delivered, self.dropped, self.incomplete, self.buffers - self.queued
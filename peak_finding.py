@@ -0,0 +1,122 @@
+
+import numpy as np
+
+"""
+Vectorized peak localization for Brillouin spectra. Every function takes a
+single row (W,) or a batch of rows (N, W) and works on the whole batch at
+once. Peak positions are sub-pixel, in pixel index units (0-based).
+"""
+
+
+# center of the brightest k pixels of each row, used to place the analysis window
+def window_center(rows, k=10):
+    single = np.ndim(rows) == 1
+    rows = np.atleast_2d(rows)
+    brightest = np.argpartition(rows, -k, axis=1)[:, -k:]
+    center = (brightest.min(axis=1) + brightest.max(axis=1)) // 2
+    return int(center[0]) if single else center
+
+
+# background level of each row, (N,)
+def background(rows, percentile=10):
+    return np.percentile(np.atleast_2d(rows), percentile, axis=1)
+
+
+# integer position of the brightest pixel in each of n_peaks equal segments, (N, n_peaks)
+def segment_maxima(rows, n_peaks):
+    rows = np.atleast_2d(rows)
+    n, w = rows.shape
+    segment = w // n_peaks
+    parts = rows[:, :segment*n_peaks].reshape(n, n_peaks, segment)
+    return parts.argmax(axis=2) + segment*np.arange(n_peaks)
+
+
+# sub-pixel refinement of the integer peaks index (N, k) of rows (N, W)
+# parabolic: vertex of the parabola through the peak and its two neighbours
+# lorentzian: same three points, fitted with a lorentzian (parabola through 1/y)
+# centroid: intensity weighted mean of the pixels within radius of the peak
+def refine(rows, index, method="parabolic", bg=None, radius=3):
+    rows = np.atleast_2d(np.asarray(rows, dtype=np.float64))
+    index = np.atleast_2d(index)
+    n, w = rows.shape
+    if bg is None:
+        bg = background(rows)
+    signal = rows - np.reshape(bg, (-1, 1))
+    line = np.arange(n)[:, None]
+
+    if method == "centroid":
+        offsets = np.arange(-radius, radius + 1)
+        positions = np.clip(index[:, :, None] + offsets, 0, w - 1)
+        weights = np.maximum(signal[line[:, :, None], positions], 0)
+        total = weights.sum(axis=2)
+        total[total == 0] = 1
+        return (weights*positions).sum(axis=2)/total
+
+    center = np.clip(index, 1, w - 2)
+    left = signal[line, center - 1]
+    middle = signal[line, center]
+    right = signal[line, center + 1]
+    if method == "lorentzian":
+        # a lorentzian is a parabola in 1/y, which needs strictly positive samples
+        floor = 1e-3*np.maximum(middle, 1)
+        left, middle, right = [1.0/np.maximum(v, floor) for v in (left, middle, right)]
+        left, middle, right = -left, -middle, -right
+    elif method != "parabolic":
+        raise ValueError("unknown refinement method: %s" % method)
+
+    curvature = left - 2*middle + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shift = np.where(curvature < 0, 0.5*(left - right)/curvature, 0)
+    return center + np.clip(shift, -1, 1)
+
+
+# full width at half maximum around the peaks index (N, k), with linear
+# interpolation of the half maximum crossings; the search for each peak stays
+# inside its segment of width segment (defaults to the whole row)
+def fwhm(rows, index, bg=None, segment=None):
+    rows = np.atleast_2d(np.asarray(rows, dtype=np.float64))
+    index = np.atleast_2d(index)
+    n, w = rows.shape
+    if bg is None:
+        bg = background(rows)
+    bg = np.reshape(bg, (-1, 1, 1))
+    if segment is None:
+        lower = np.zeros_like(index)
+        upper = np.full_like(index, w - 1)
+    else:
+        lower = (index // segment)*segment
+        upper = np.minimum(lower + segment - 1, w - 1)
+
+    positions = np.arange(w)
+    line = np.arange(n)[:, None]
+    peak = rows[line, index]
+    half = (peak[:, :, None] - bg)/2 + bg
+    below = rows[:, None, :] <= half
+
+    right_mask = below & (positions > index[:, :, None]) & (positions <= upper[:, :, None])
+    left_mask = below & (positions < index[:, :, None]) & (positions >= lower[:, :, None])
+    right = np.where(right_mask.any(axis=2), np.where(right_mask, positions, w).min(axis=2), upper)
+    left = np.where(left_mask.any(axis=2), np.where(left_mask, positions, -1).max(axis=2), lower)
+
+    half = half[:, :, 0]
+    # interpolate between the crossing pixel and its neighbour towards the peak
+    right_in = np.maximum(right - 1, index)
+    left_in = np.minimum(left + 1, index)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        right_frac = (rows[line, right_in] - half)/(rows[line, right_in] - rows[line, right])
+        left_frac = (rows[line, left_in] - half)/(rows[line, left_in] - rows[line, left])
+    right_x = right_in + np.nan_to_num(np.clip(right_frac, 0, 1))*(right - right_in)
+    left_x = left_in - np.nan_to_num(np.clip(left_frac, 0, 1))*(left_in - left)
+    return right_x - left_x
+
+
+# sub-pixel position, height above background and fwhm of the brightest peak
+# in each of n_peaks equal segments, each (N, n_peaks)
+def find_peaks(rows, n_peaks, method="lorentzian"):
+    rows = np.atleast_2d(np.asarray(rows, dtype=np.float64))
+    bg = background(rows)
+    index = segment_maxima(rows, n_peaks)
+    height = rows[np.arange(rows.shape[0])[:, None], index] - bg[:, None]
+    position = refine(rows, index, method, bg)
+    width = fwhm(rows, index, bg, rows.shape[1] // n_peaks)
+    return position, height, width, bg
@@ -0,0 +1,234 @@
+
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import pupil_detectors
+
+"""
+Headless batch version of hough_transform.detect_pupil_video. Every video is
+split into chunks of frames and the chunks are handed to a process pool; each
+worker opens the video itself, seeks to its chunk and runs a pupil detector
+on the frames, so frames never have to be sent between processes. Per frame
+results are written as one .npy file per chunk and, once all chunks of a
+video are done, merged into a columnar <video>.npz (one array per column:
+frame, timestamp, x, y, radius, confidence), at the path of the video
+relative to the directory all inputs share. Chunks that already exist are
+skipped, so an interrupted run can simply be started again.
+
+    python pupil_batch.py pupil_videos/ -o pupil_results -j 8
+"""
+
+RESULT_DTYPE = np.dtype([("frame", np.int64),
+                         ("timestamp", np.float64),
+                         ("x", np.float64),
+                         ("y", np.float64),
+                         ("radius", np.float64),
+                         ("confidence", np.float64)])
+
+VIDEO_EXTENSIONS = (".avi", ".mp4", ".mov", ".mkv")
+
+
+# all video files in paths, directories are searched (not recursively)
+def find_videos(paths):
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            videos.extend(sorted(p for p in glob.glob(os.path.join(path, "*"))
+                                 if p.lower().endswith(VIDEO_EXTENSIONS)))
+        else:
+            videos.append(path)
+    return videos
+
+
+# result name (relative path without extension) of every video, below the directory they all share
+def result_names(videos):
+    dirs = [os.path.dirname(os.path.abspath(path)) for path in videos]
+    common = os.path.commonprefix([d + os.sep for d in dirs])
+    common = common[:common.rfind(os.sep) + 1]
+    names = [os.path.splitext(os.path.relpath(os.path.abspath(path), common))[0] for path in videos]
+    seen = {}
+    for path, name in zip(videos, names):
+        if name in seen:
+            raise ValueError("%s and %s would both be written to %s.npz" % (seen[name], path, name))
+        seen[name] = path
+    return names
+
+
+def frame_count(path):
+    cap = cv2.VideoCapture(path)
+    count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if count <= 0:
+        # container without a frame count, decode it once
+        count = 0
+        while cap.grab():
+            count += 1
+    cap.release()
+    return count
+
+
+def chunk_path(chunk_dir, chunk):
+    return os.path.join(chunk_dir, "chunk_%06d.npy" % chunk)
+
+
+# saves to a temporary file first so a killed run never leaves half written results
+def save_atomic(path, save, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        save(f, data)
+    # rename does not replace an existing file on Windows
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+
+
+# results for count frames starting at start, count None reads to the end of the video
+def analyze_chunk(path, start, count, detector):
+    cap = cv2.VideoCapture(path)
+    if start > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    detector.reset()
+
+    results = []
+    index = start
+    while count is None or index < start + count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        timestamp = cap.get(cv2.CAP_PROP_POS_MSEC)/1000.0
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        pupil = detector.detect(gray)
+        if pupil.center is None:
+            results.append((index, timestamp, np.nan, np.nan, np.nan, 0.0))
+        else:
+            results.append((index, timestamp, pupil.center[0], pupil.center[1], pupil.radius, pupil.confidence))
+        index += 1
+    cap.release()
+    return np.array(results, dtype=RESULT_DTYPE)
+
+
+_detector = None
+
+
+def _init_worker(name, options):
+    global _detector
+    _detector = pupil_detectors.create(name, **options)
+
+
+def _run_chunk(task):
+    path, chunk, start, count, out = task
+    results = analyze_chunk(path, start, count, _detector)
+    save_atomic(out, np.save, results)
+    return path, chunk, len(results), int(np.isfinite(results["x"]).sum())
+
+
+def merge(chunk_dir, n_chunks, out):
+    chunks = [np.load(chunk_path(chunk_dir, chunk)) for chunk in range(n_chunks)]
+    results = np.concatenate(chunks) if chunks else np.zeros(0, dtype=RESULT_DTYPE)
+    save_atomic(out, lambda f, data: np.savez(f, **data),
+                dict((name, results[name]) for name in RESULT_DTYPE.names))
+    for chunk in range(n_chunks):
+        os.remove(chunk_path(chunk_dir, chunk))
+    os.rmdir(chunk_dir)
+    return results
+
+
+# {column: array} of a merged result file
+def load(path):
+    with np.load(path) as data:
+        return dict((name, data[name]) for name in data.files)
+
+
+def run(videos, output, detector="Hough", options=None, processes=None, chunk_size=200):
+    options = options or {}
+    if not os.path.isdir(output):
+        os.makedirs(output)
+
+    # (path, chunk dir, number of chunks, result file) of every video not analyzed yet
+    jobs = []
+    tasks = []
+    for path, name in zip(videos, result_names(videos)):
+        out = os.path.join(output, name + ".npz")
+        if os.path.exists(out):
+            print "skipping", path, "(already analyzed)"
+            continue
+        chunk_dir = os.path.join(output, name + ".chunks")
+        if not os.path.isdir(chunk_dir):
+            os.makedirs(chunk_dir)
+
+        n_chunks = max((frame_count(path) + chunk_size - 1)//chunk_size, 1)
+        jobs.append((path, chunk_dir, n_chunks, out))
+        for chunk in range(n_chunks):
+            if os.path.exists(chunk_path(chunk_dir, chunk)):
+                continue
+            # the last chunk reads to the end, in case the frame count was off
+            count = chunk_size if chunk < n_chunks - 1 else None
+            tasks.append((path, chunk, chunk*chunk_size, count, chunk_path(chunk_dir, chunk)))
+
+    total_chunks = sum(job[2] for job in jobs)
+    print "%d videos, %d of %d chunks left" % (len(jobs), len(tasks), total_chunks)
+
+    pool = multiprocessing.Pool(processes, _init_worker, (detector, options))
+    try:
+        frames = 0
+        detected = 0
+        start = time.time()
+        for done, (path, chunk, n, found) in enumerate(pool.imap_unordered(_run_chunk, tasks), 1):
+            frames += n
+            detected += found
+            elapsed = time.time() - start
+            sys.stdout.write("\r%d/%d chunks, %d frames (%.1f fps), pupil found in %.1f%%   " %
+                             (done, len(tasks), frames, frames/max(elapsed, 1e-6), 100.0*detected/max(frames, 1)))
+            sys.stdout.flush()
+        if tasks:
+            print
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        print
+        print "interrupted, finished chunks are kept and skipped on the next run"
+        raise
+    except BaseException:
+        # join() needs the pool closed or terminated, or it hides the error with an AssertionError
+        pool.terminate()
+        print
+        print "failed, finished chunks are kept and skipped on the next run"
+        raise
+    finally:
+        pool.join()
+
+    for path, chunk_dir, n_chunks, out in jobs:
+        results = merge(chunk_dir, n_chunks, out)
+        print "%s: %d frames -> %s" % (path, len(results), out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detect the pupil in recorded pupil camera videos")
+    parser.add_argument("inputs", nargs="+", help="video files or directories of videos")
+    parser.add_argument("-o", "--output", default="pupil_results", help="directory for the result files")
+    parser.add_argument("-d", "--detector", default="Hough", choices=sorted(pupil_detectors.DETECTORS))
+    parser.add_argument("-r", "--radius", type=int, default=180, help="expected pupil radius (Hough)")
+    parser.add_argument("--radius-range", type=int, default=15, help="allowed radius deviation (Hough)")
+    parser.add_argument("-j", "--processes", type=int, default=None, help="worker processes (all cores)")
+    parser.add_argument("-c", "--chunk-size", type=int, default=200, help="frames per chunk")
+    args = parser.parse_args(argv)
+
+    options = {}
+    if args.detector == "Hough":
+        options = {"expected_radius": args.radius, "radius_range": args.radius_range}
+
+    videos = find_videos(args.inputs)
+    if not videos:
+        parser.error("no videos found")
+    run(videos, args.output, args.detector, options, args.processes, args.chunk_size)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
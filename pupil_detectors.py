@@ -0,0 +1,146 @@
+
+import math
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+import hough_transform as ht
+
+"""
+Interchangeable pupil detectors. Every detector takes the single channel
+uint8 pupil camera frame and returns a PupilResult, so the GUI can switch
+between them at runtime:
+
+    Hough   - hough_transform.TrackingHoughDetector, robust but expensive
+    Contour - threshold + morphology + contours + fitEllipse from mako_pupil.py,
+              much cheaper but needs even, dark pupil illumination
+"""
+
+# center (x, y) and radius in pixels, ellipse as returned by cv2.fitEllipse (or None),
+# confidence between 0 and 1; center and radius are None if no pupil was found
+PupilResult = namedtuple("PupilResult", ["center", "radius", "ellipse", "confidence"])
+NOT_FOUND = PupilResult(None, None, None, 0.0)
+
+
+# how much darker the pupil is than the iris around it, sampled on two circles
+def contrast_confidence(gray, center, radius, samples=64):
+    angles = np.linspace(0, 2*math.pi, samples, endpoint=False)
+    h, w = gray.shape[:2]
+
+    def ring(r):
+        xs = np.clip((center[0] + r*np.cos(angles)).astype(int), 0, w - 1)
+        ys = np.clip((center[1] + r*np.sin(angles)).astype(int), 0, h - 1)
+        return gray[ys, xs].mean()
+
+    inside = ring(0.5*radius)
+    outside = ring(1.3*radius)
+    return float(np.clip((outside - inside)/max(outside, 1.0), 0, 1))
+
+
+# detectors implement detect(gray), which returns the PupilResult for the uint8 mono frame gray
+class PupilDetector(object):
+    name = None
+
+    # forget any state kept between frames
+    def reset(self):
+        pass
+
+    # pupil radius picked by the user in the GUI
+    def set_expected_radius(self, radius):
+        pass
+
+
+class HoughDetector(PupilDetector):
+    name = "Hough"
+
+    def __init__(self, expected_radius=180, radius_range=15, **kwargs):
+        self.tracker = ht.TrackingHoughDetector(expected_radius, radius_range, **kwargs)
+
+    def detect(self, gray):
+        center, radius = self.tracker.detect(gray)
+        if center is None:
+            return NOT_FOUND
+        return PupilResult(center, radius, None, contrast_confidence(gray, center, radius))
+
+    def reset(self):
+        self.tracker.reset()
+
+    def set_expected_radius(self, radius):
+        self.tracker.expected_radius = radius
+
+
+class ContourDetector(PupilDetector):
+    name = "Contour"
+
+    # threshold and area limits as tuned in mako_pupil.py
+    def __init__(self, threshold=25, min_area=3000, max_area=100000, max_circularity=1.2, max_extent=0.8):
+        self.threshold = threshold
+        self.min_area = min_area
+        self.max_area = max_area
+        self.max_circularity = max_circularity
+        self.max_extent = max_extent
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
+
+    def detect(self, gray):
+        retval, threshold = cv2.threshold(gray, self.threshold, 255, 0)
+        closed = cv2.erode(cv2.dilate(threshold, self.kernel, iterations=1), self.kernel, iterations=1)
+        # findContours returns 3 values in OpenCV 3 and 2 in OpenCV 4
+        contours = cv2.findContours(closed, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)[-2]
+
+        best = None
+        best_circularity = float('inf')
+        for contour in contours:
+            contour = cv2.convexHull(contour)
+            area = cv2.contourArea(contour)
+            if area < self.min_area or area > self.max_area:
+                continue
+
+            circumference = cv2.arcLength(contour, True)
+            circularity = circumference**2 / (4*math.pi*area)
+            if circularity > self.max_circularity:
+                continue
+
+            bounding_box = cv2.boundingRect(contour)
+            extent = area / (bounding_box[2] * bounding_box[3])
+            if extent > self.max_extent:
+                continue
+
+            if circularity < best_circularity and len(contour) >= 5:
+                best = contour
+                best_circularity = circularity
+
+        if best is None:
+            return NOT_FOUND
+
+        ellipse = cv2.fitEllipse(best)
+        m = cv2.moments(best)
+        if m['m00'] != 0:
+            center = (int(m['m10'] / m['m00']), int(m['m01'] / m['m00']))
+        else:
+            center = (int(ellipse[0][0]), int(ellipse[0][1]))
+        radius = int(round((ellipse[1][0] + ellipse[1][1])/4))
+        # polygon circularity can come out slightly below 1
+        return PupilResult(center, radius, ellipse, float(np.clip(1.0/best_circularity, 0, 1)))
+
+
+DETECTORS = {HoughDetector.name: HoughDetector,
+             ContourDetector.name: ContourDetector}
+
+
+def create(name, **kwargs):
+    return DETECTORS[name](**kwargs)
+
+
+# draws result onto the BGR image frame, scale is frame size / detection size
+def draw(frame, result, scale=1.0, color=(255,0,0)):
+    if result.center is None:
+        return frame
+    center = (int(result.center[0]*scale), int(result.center[1]*scale))
+    if result.ellipse is not None:
+        (x, y), (a, b), angle = result.ellipse
+        cv2.ellipse(frame, ((x*scale, y*scale), (a*scale, b*scale), angle), color, 2)
+    else:
+        cv2.circle(frame, center, int(result.radius*scale), color, 2)
+    cv2.circle(frame, center, 2, color, 3)
+    return frame
@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+
+"""
+Binary log of the pupil position in every pupil camera frame, the only record
+of the pupil data: while Record is on it is written to <path>.log next to the
+frames kept by pupil_recorder at <path>. Every frame is one fixed width
+LOG_DTYPE record; records are collected in a preallocated block and the block is appended to the file when it is full (and on flush or
+close), so logging a frame is a single array assignment. The file starts
+with a short magic header and is otherwise a plain array, load() maps it
+straight back into numpy. brillouin_seq is the sequence number of the last
+EMCCD frame acquired before the pupil frame, which makes joins with the
+Brillouin shift history a vectorized lookup.
+"""
+
+MAGIC = b"PUPILLOG3".ljust(16, b"\0")
+
+# x, y and radius are nan when no pupil was found, detected is False for
+# frames where the tracker only predicted the position, blink and saccade are
+# the pupil_tracker.TrackedPupil flags, detector is the name of the
+# pupil_detectors detector that was used
+LOG_DTYPE = np.dtype([("frame", "<i8"),
+                      ("host_time", "<f8"),
+                      ("camera_time", "<f8"),
+                      ("x", "<f4"),
+                      ("y", "<f4"),
+                      ("radius", "<f4"),
+                      ("confidence", "<f4"),
+                      ("detected", "u1"),
+                      ("blink", "u1"),
+                      ("saccade", "u1"),
+                      ("brillouin_seq", "<i8"),
+                      ("detector", "S16")])
+
+
+class PupilLog(object):
+    def __init__(self, path='data_acquisition/pupil_data.log', flush_every=100):
+        self.path = path
+        self.block = np.zeros(flush_every, dtype=LOG_DTYPE)
+        self.pending = 0
+        self.count = 0
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+
+    # center and radius are None if no pupil was found
+    def append(self, frame, host_time, camera_time, center, radius, detected, brillouin_seq=-1,
+               confidence=np.nan, detector="", blink=False, saccade=False):
+        record = self.block[self.pending]
+        record["frame"] = frame
+        record["host_time"] = host_time
+        record["camera_time"] = camera_time
+        if center is None:
+            record["x"] = record["y"] = record["radius"] = np.nan
+        else:
+            record["x"], record["y"] = center
+            record["radius"] = radius
+        record["confidence"] = confidence
+        record["detected"] = detected
+        record["blink"] = blink
+        record["saccade"] = saccade
+        record["brillouin_seq"] = brillouin_seq
+        record["detector"] = detector
+        self.pending += 1
+        self.count += 1
+        if self.pending == len(self.block):
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.file.write(self.block[:self.pending].tobytes())
+            self.pending = 0
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+# LOG_DTYPE records of the log at path, read only and mapped from disk; a
+# partly written record at the end (e.g. after a crash) is ignored
+def load(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a pupil log" % path)
+    count = (os.path.getsize(path) - len(MAGIC))//LOG_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=LOG_DTYPE)
+    return np.memmap(path, LOG_DTYPE, "r", offset=len(MAGIC), shape=(count,))
+
+
+# the log as a pandas DataFrame, needs pandas
+def load_dataframe(path):
+    import pandas as pd
+    return pd.DataFrame(np.asarray(load(path)))
@@ -0,0 +1,142 @@
+import sys
+import threading
+import traceback
+import Queue
+
+import cv2
+import numpy as np
+import skvideo.io as skv
+
+import pupil_detectors
+import pupil_log
+import raw_store
+
+"""
+Records the pupil camera while the video thread keeps running. Frames are
+put into a bounded queue and a writer thread appends them as they arrive, so
+memory use does not grow with the length of the recording and stopping only
+has to write what is still queued. When the writer falls behind, write()
+either blocks until there is room (block=True) or drops the frame and counts
+it; dropped frames are never copied.
+
+Only the single channel frames are kept, in a raw_store file at <path>. The
+pupil position of every frame, recorded or dropped, is in the pupil_log at
+<path>.log that videoLoop writes at the same time, and load() matches the two
+by sequence number. Nothing is drawn into the frames, so recordings can be
+analyzed again with other detectors; the annotated video is rendered by
+export():
+
+    python pupil_recorder.py data_acquisition/pupil_recording
+"""
+
+OUTPUT_DICT = {
+    '-vcodec':'libx264',
+    '-b':'30000000',
+    '-vf':'setpts=4*PTS'
+    }
+
+
+class PupilRecorder(object):
+    def __init__(self, path='data_acquisition/pupil_recording', maxsize=64, block=False, flush_every=100):
+        self.path = path
+        self.block = block
+        self.flush_every = flush_every
+        self.queue = Queue.Queue(maxsize)
+        self.written = 0
+        self.dropped = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._record, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    # queues a copy of the mono frame image, returns False if the frame was dropped
+    def write(self, image, seq, timestamp):
+        if not self.block and self.queue.full():
+            self.dropped += 1
+            return False
+        try:
+            self.queue.put((image.copy(), seq, timestamp), block=self.block)
+        except Queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    # no more frames are accepted, the writer finishes what is queued;
+    # wait blocks until the files are closed
+    def stop(self, wait=False):
+        self.queue.put(None)
+        if wait and self.thread is not None:
+            self.thread.join()
+
+    def _record(self):
+        try:
+            self._write_frames()
+        except Exception:
+            print "Error recording pupil video"
+            print "Stack trace: ", traceback.format_exc()
+            # keep emptying the queue so write() and stop() never block
+            while self.queue.get() is not None:
+                self.dropped += 1
+
+    def _write_frames(self):
+        store = None
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                frame, seq, timestamp = item
+                if store is None:
+                    store = raw_store.RawStoreWriter(self.path, frame.shape, frame.dtype, flush_every=self.flush_every)
+                store.append(frame, seq, timestamp)
+                self.written += 1
+        finally:
+            if store is not None:
+                store.close()
+        print "finished recording!", self.written, "frames written,", self.dropped, "dropped"
+
+
+# (raw_store.RawStore of the frames, pupil_log.LOG_DTYPE record of every stored
+# frame) of a recording; frames missing from the log get a not found record
+def load(path):
+    frames = raw_store.RawStore(path)
+    log = pupil_log.load(path + ".log")
+    seq = frames.index["seq"]
+    records = np.zeros(len(seq), dtype=pupil_log.LOG_DTYPE)
+    records["frame"] = seq
+    records["camera_time"] = frames.index["timestamp"]
+    records["x"] = records["y"] = records["radius"] = records["confidence"] = np.nan
+    records["brillouin_seq"] = -1
+    if len(log):
+        # the log is in frame order
+        found = np.minimum(np.searchsorted(log["frame"], seq), len(log) - 1)
+        matched = log["frame"][found] == seq
+        records[matched] = log[found[matched]]
+    return frames, records
+
+
+def pupil_result(record):
+    if np.isnan(record["x"]):
+        return pupil_detectors.NOT_FOUND
+    return pupil_detectors.PupilResult((int(record["x"]), int(record["y"])), int(record["radius"]),
+                                       None, float(record["confidence"]))
+
+
+# renders the recording at path as an annotated video
+def export(path, video_path='data_acquisition/pupil_video.avi', outputdict=OUTPUT_DICT):
+    frames, records = load(path)
+    writer = skv.FFmpegWriter(video_path, outputdict=outputdict)
+    try:
+        for index, record in enumerate(records):
+            frame = cv2.cvtColor(np.asarray(frames[index]), cv2.COLOR_GRAY2BGR)
+            pupil_detectors.draw(frame, pupil_result(record))
+            writer.writeFrame(frame)
+    finally:
+        writer.close()
+    print "exported", len(records), "frames to", video_path
+
+
+if __name__ == "__main__":
+    export(*sys.argv[1:])
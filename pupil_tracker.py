@@ -0,0 +1,136 @@
+
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+import pupil_detectors
+
+"""
+Constant velocity Kalman filter over the pupil center and radius, layered on
+top of any pupil_detectors.PupilDetector. The expensive detector only runs
+every detect_every frames, or earlier when the predicted position has become
+too uncertain or the image changed a lot since the last detection; in
+between the tracker reports the predicted position. Detections are used to
+correct the state, which also smooths the jitter of single frame detections.
+
+Frames where the detector finds no pupil are flagged as blinks, detections
+that are far outside the predicted uncertainty as saccades (the filter then
+jumps to the new position instead of averaging).
+"""
+
+# result is a pupil_detectors.PupilResult with the filtered center and radius,
+# detected tells whether the detector ran on this frame
+TrackedPupil = namedtuple("TrackedPupil", ["result", "detected", "blink", "saccade"])
+
+# 99.9% quantile of the chi square distribution with 3 degrees of freedom
+SACCADE_GATE = 16.27
+
+
+class KalmanPupilTracker(object):
+    def __init__(self, detector, detect_every=5, max_uncertainty=20.0, diff_threshold=6.0,
+                 process_noise=50.0, measurement_noise=2.0, max_misses=5):
+        self.detector = detector
+        self.detect_every = detect_every
+        # position standard deviation (pixels) above which the detector runs
+        self.max_uncertainty = max_uncertainty
+        # mean absolute grey level change of the thumbnail that triggers a detection
+        self.diff_threshold = diff_threshold
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.max_misses = max_misses
+
+        # state is [x, y, radius, vx, vy, vradius], velocities in pixels per second
+        self.H = np.hstack((np.eye(3), np.zeros((3, 3))))
+        self.R = np.eye(3)*measurement_noise**2
+        self.reset()
+
+    def reset(self):
+        self.x = None
+        self.P = None
+        self.last_time = None
+        self.since_detection = 0
+        self.misses = 0
+        self.thumbnail = None
+        self.confidence = 0.0
+        self.detector.reset()
+
+    def predict(self, dt):
+        F = np.eye(6)
+        F[:3, 3:] = np.eye(3)*dt
+        # white acceleration noise
+        q = self.process_noise**2
+        Q = np.zeros((6, 6))
+        Q[:3, :3] = np.eye(3)*q*dt**4/4
+        Q[:3, 3:] = np.eye(3)*q*dt**3/2
+        Q[3:, :3] = np.eye(3)*q*dt**3/2
+        Q[3:, 3:] = np.eye(3)*q*dt**2
+        self.x = F.dot(self.x)
+        self.P = F.dot(self.P).dot(F.T) + Q
+
+    # returns True if z was a saccade (state re-initialized) instead of a normal correction
+    def correct(self, z):
+        y = z - self.H.dot(self.x)
+        S = self.H.dot(self.P).dot(self.H.T) + self.R
+        S_inv = np.linalg.inv(S)
+        if y.dot(S_inv).dot(y) > SACCADE_GATE:
+            self.initialize(z)
+            return True
+        K = self.P.dot(self.H.T).dot(S_inv)
+        self.x = self.x + K.dot(y)
+        self.P = (np.eye(6) - K.dot(self.H)).dot(self.P)
+        return False
+
+    def initialize(self, z):
+        self.x = np.hstack((z, np.zeros(3)))
+        self.P = np.diag([self.measurement_noise**2]*3 + [self.process_noise**2]*3)
+
+    def _thumbnail(self, gray):
+        return cv2.resize(gray, (64, 64), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def _needs_detection(self, thumbnail):
+        # keep detecting on every frame after a miss (blink) until the pupil is back
+        if self.x is None or self.misses > 0 or self.since_detection >= self.detect_every - 1:
+            return True
+        if np.sqrt(max(self.P[0, 0], self.P[1, 1])) > self.max_uncertainty:
+            return True
+        return np.abs(thumbnail - self.thumbnail).mean() > self.diff_threshold
+
+    # TrackedPupil for the uint8 mono frame gray taken at timestamp (seconds)
+    def update(self, gray, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        if self.x is not None:
+            self.predict(max(timestamp - self.last_time, 1e-3))
+        self.last_time = timestamp
+
+        thumbnail = self._thumbnail(gray)
+        if not self._needs_detection(thumbnail):
+            self.since_detection += 1
+            return TrackedPupil(self._state_result(), False, False, False)
+
+        self.since_detection = 0
+        self.thumbnail = thumbnail
+        detection = self.detector.detect(gray)
+        if detection.center is None:
+            self.misses += 1
+            if self.misses >= self.max_misses:
+                self.x = None
+                self.P = None
+            return TrackedPupil(pupil_detectors.NOT_FOUND, True, True, False)
+
+        self.misses = 0
+        self.confidence = detection.confidence
+        z = np.array([detection.center[0], detection.center[1], detection.radius], dtype=np.float64)
+        saccade = False
+        if self.x is None:
+            self.initialize(z)
+        else:
+            saccade = self.correct(z)
+        return TrackedPupil(self._state_result(detection.ellipse), True, False, saccade)
+
+    def _state_result(self, ellipse=None):
+        if self.x is None:
+            return pupil_detectors.NOT_FOUND
+        center = (int(round(self.x[0])), int(round(self.x[1])))
+        return pupil_detectors.PupilResult(center, int(round(self.x[2])), ellipse, self.confidence)
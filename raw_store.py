@@ -0,0 +1,125 @@
+import json
+import os
+
+import numpy as np
+
+"""
+Lossless raw frame recording. Frames are appended at their native depth
+(uint8 for the Mako, uint16 for the Andor) to a preallocated, memory mapped
+<path>.raw file, so recording is a memory copy and the operating system
+writes the pages out in the background; compression or transcoding can be
+done offline. Next to it <path>.idx holds one INDEX_DTYPE record per frame
+(sequence number, timestamp, motor position, shutter state) and <path>.json
+the frame shape, dtype, number of frames and any metadata given by the
+recorder (e.g. the EMCCD readout area and binning). Both files grow by doubling if
+the preallocated capacity runs out. The header is rewritten every
+flush_every frames, so a recording that was not closed can still be read up
+to the last flush.
+
+RawStore reads a recording back as lazy numpy views on the file.
+"""
+
+INDEX_DTYPE = np.dtype([("seq", np.int64),
+                        ("timestamp", np.float64),
+                        ("position", np.float64),
+                        ("shutter", np.int8)])
+
+
+def _read_header(path):
+    with open(path + ".json") as f:
+        return json.load(f)
+
+
+class RawStoreWriter(object):
+    def __init__(self, path, shape, dtype, capacity=1000, flush_every=100, metadata=None):
+        self.path = path
+        self.metadata = metadata or {}
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.flush_every = flush_every
+        self.count = 0
+        self.capacity = max(int(capacity), 1)
+        self.frames = np.memmap(path + ".raw", self.dtype, "w+", shape=(self.capacity,) + self.shape)
+        self.index = np.memmap(path + ".idx", INDEX_DTYPE, "w+", shape=(self.capacity,))
+        self.write_header()
+
+    def __len__(self):
+        return self.count
+
+    def write_header(self):
+        header = {"shape": self.shape, "dtype": self.dtype.str, "count": self.count, "metadata": self.metadata}
+        tmp = self.path + ".json.tmp"
+        with open(tmp, "w") as f:
+            json.dump(header, f)
+        if os.path.exists(self.path + ".json"):
+            os.remove(self.path + ".json")
+        os.rename(tmp, self.path + ".json")
+
+    def _grow(self):
+        self.frames.flush()
+        self.index.flush()
+        self.capacity *= 2
+        # mapping an existing file with a larger shape extends it and keeps its contents
+        del self.frames, self.index
+        self.frames = np.memmap(self.path + ".raw", self.dtype, "r+", shape=(self.capacity,) + self.shape)
+        self.index = np.memmap(self.path + ".idx", INDEX_DTYPE, "r+", shape=(self.capacity,))
+
+    # position is the motor position (nan if unknown), shutter the shutter state (-1 if unknown)
+    def append(self, frame, seq, timestamp, position=np.nan, shutter=-1):
+        if frame.shape != self.shape:
+            raise ValueError("frame shape %s does not match the store shape %s" % (frame.shape, self.shape))
+        if self.count == self.capacity:
+            self._grow()
+        self.frames[self.count] = frame
+        self.index[self.count] = (seq, timestamp, position, shutter)
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self.write_header()
+
+    def flush(self):
+        self.frames.flush()
+        self.index.flush()
+        self.write_header()
+
+    # writes everything out and cuts the files down to the frames actually recorded
+    def close(self):
+        self.frames.flush()
+        self.index.flush()
+        del self.frames, self.index
+        for name, size in ((self.path + ".raw", self.count*self.dtype.itemsize*int(np.prod(self.shape))),
+                           (self.path + ".idx", self.count*INDEX_DTYPE.itemsize)):
+            with open(name, "r+b") as f:
+                f.truncate(size)
+        self.write_header()
+
+
+class RawStore(object):
+    def __init__(self, path):
+        header = _read_header(path)
+        self.path = path
+        self.shape = tuple(header["shape"])
+        self.dtype = np.dtype(header["dtype"])
+        self.count = header["count"]
+        self.metadata = header.get("metadata", {})
+        if self.count > 0:
+            self.frames = np.memmap(path + ".raw", self.dtype, "r", shape=(self.count,) + self.shape)
+            self.index = np.memmap(path + ".idx", INDEX_DTYPE, "r", shape=(self.count,))
+        else:
+            self.frames = np.zeros((0,) + self.shape, dtype=self.dtype)
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return self.count
+
+    # frames are only read from disk when the returned view is used
+    def __getitem__(self, key):
+        return self.frames[key]
+
+    # (frames, index records) for frames start to stop
+    def range(self, start, stop=None):
+        return self.frames[start:stop], self.index[start:stop]
+
+    # position of the frame with sequence number seq, None if it was not recorded
+    def find(self, seq):
+        found = np.nonzero(self.index["seq"] == seq)[0]
+        return int(found[0]) if len(found) else None
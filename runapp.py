@@ -1,8 +1,12 @@
 # from __future__ import print_function
+import multiprocessing
 from app import App
 from imutils.video import VideoStream
 
-wind = App("C:\Users\leon\Documents\modified Python Code")
+# the guard keeps the analysis worker processes from opening another window on Windows
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    wind = App("C:\Users\leon\Documents\modified Python Code")
 
 
-wind.root.mainloop()
+    wind.root.mainloop()
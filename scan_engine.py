@@ -0,0 +1,251 @@
+import threading
+import time
+import traceback
+import Queue
+
+"""
+Runs scans on a background thread so the Tk main loop and the live views keep
+going while the motor moves. Scans are queued and executed one after the
+other; each one goes through the states
+
+    queued -> running <-> paused -> done | aborted | failed
+
+and every change and finished step is reported through on_event(scan, event),
+called from the engine thread. The hardware is reached only through the
+callbacks given to the engine:
+
+    move(position)                   blocking move, returns the position reached
+    acquire(scan)                    blocking, returns a frame exposed at the
+                                     current position; long waits should call
+                                     scan.check() so pause and abort work
+    store(scan, index, position, frame)   optional, runs on an export thread
+    finish(scan)                     optional, after the last store
+    sweep(scan, end)                 optional, for continuous scans: moves to end
+                                     while acquiring, returns [(frame, position)]
+
+As soon as a frame is acquired the move to the next position starts, while
+the frame is stored on the export thread, so moving and exporting overlap.
+Continuous scans (submit_sweep) move to the start and then sweep to the end
+in one move, taking frames on the way instead of stopping for every one.
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+ABORTED = "aborted"
+DONE = "done"
+FAILED = "failed"
+
+
+class ScanAborted(Exception):
+    pass
+
+
+class Scan(object):
+    # a continuous scan sweeps from positions[0] to positions[1]
+    def __init__(self, positions, name="scan", continuous=False, estimate=None):
+        self.positions = list(positions)
+        self.name = name
+        self.continuous = continuous
+        # expected duration in seconds, if the submitter knows it
+        self.estimate = estimate
+        # number of frames, only known after the sweep for continuous scans
+        self.steps = 0 if continuous else len(self.positions)
+        self.state = QUEUED
+        # number of finished steps and the positions the motor actually reached
+        self.index = 0
+        self.reached = []
+        self.error = None
+        self.started = None
+        self.finished = None
+        # anything the store callback wants to keep about the steps, e.g. their shifts
+        self.results = []
+        self.notify = None
+        self.finished_event = threading.Event()
+        self.running_event = threading.Event()
+        self.running_event.set()
+        self.cancel_event = threading.Event()
+
+    def __len__(self):
+        return self.steps
+
+    def _set_state(self, state):
+        self.state = state
+        if state in (ABORTED, DONE, FAILED):
+            self.finished_event.set()
+        if self.notify is not None:
+            self.notify(self, state)
+
+    # blocks until the scan is done, aborted or failed, False on timeout
+    def wait(self, timeout=None):
+        return self.finished_event.wait(timeout)
+
+    def pause(self):
+        if self.state == RUNNING:
+            self.running_event.clear()
+            self._set_state(PAUSED)
+
+    def resume(self):
+        if self.state == PAUSED:
+            self.running_event.set()
+            self._set_state(RUNNING)
+
+    # the scan stops at the next check(), a queued scan is skipped
+    def abort(self):
+        self.cancel_event.set()
+        self.running_event.set()
+
+    @property
+    def aborted(self):
+        return self.cancel_event.is_set()
+
+    # blocks while the scan is paused and raises ScanAborted once it is aborted
+    def check(self):
+        while not self.running_event.wait(0.1):
+            pass
+        if self.cancel_event.is_set():
+            raise ScanAborted()
+
+
+class ScanEngine(object):
+    def __init__(self, move, acquire, store=None, finish=None, on_event=None, sweep=None):
+        self.move = move
+        self.acquire = acquire
+        self.store = store
+        self.finish = finish
+        self.sweep = sweep
+        self.on_event = on_event
+        self.scans = Queue.Queue()
+        self.current = None
+        self.thread = threading.Thread(target=self._run, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _event(self, scan, event):
+        if self.on_event is not None:
+            try:
+                self.on_event(scan, event)
+            except Exception:
+                print "Error in scan event handler"
+                print "Stack trace: ", traceback.format_exc()
+
+    # queues a scan over positions and returns it
+    def submit(self, positions, name="scan", estimate=None):
+        return self._submit(Scan(positions, name, estimate=estimate))
+
+    # queues a continuous scan from start to end and returns it
+    def submit_sweep(self, start, end, name="sweep"):
+        if self.sweep is None:
+            raise ValueError("the scan engine has no sweep callback")
+        return self._submit(Scan([start, end], name, continuous=True))
+
+    def _submit(self, scan):
+        scan.notify = self._event
+        self.scans.put(scan)
+        self._event(scan, QUEUED)
+        return scan
+
+    # aborts the running scan and everything queued
+    def abort_all(self):
+        pending = []
+        while True:
+            try:
+                pending.append(self.scans.get_nowait())
+            except Queue.Empty:
+                break
+        for scan in pending:
+            scan.abort()
+            self.scans.put(scan)
+        if self.current is not None:
+            self.current.abort()
+
+    def stop(self):
+        self.abort_all()
+        self.scans.put(None)
+
+    def _run(self):
+        while True:
+            scan = self.scans.get()
+            if scan is None:
+                return
+            if scan.aborted:
+                scan._set_state(ABORTED)
+                continue
+            self.current = scan
+            self._execute(scan)
+            self.current = None
+
+    def _export(self, scan, exports):
+        while True:
+            item = exports.get()
+            if item is None:
+                return
+            if scan.error is not None:
+                continue
+            try:
+                self.store(scan, *item)
+            except Exception:
+                scan.error = traceback.format_exc()
+                scan.abort()
+
+    def _step(self, scan, exports):
+        if scan.positions:
+            scan.reached.append(self.move(scan.positions[0]))
+        for index in range(len(scan.positions)):
+            scan.check()
+            frame = self.acquire(scan)
+            exports.put((index, scan.reached[index], frame))
+            # the next move overlaps with storing this frame
+            if index + 1 < len(scan.positions):
+                scan.check()
+                scan.reached.append(self.move(scan.positions[index + 1]))
+            scan.index = index + 1
+            self._event(scan, "step")
+
+    def _sweep(self, scan, exports):
+        self.move(scan.positions[0])
+        scan.check()
+        frames = self.sweep(scan, scan.positions[1])
+        scan.steps = len(frames)
+        for index, (frame, position) in enumerate(frames):
+            scan.reached.append(position)
+            exports.put((index, position, frame))
+        scan.index = len(frames)
+        self._event(scan, "step")
+        scan.check()
+
+    def _execute(self, scan):
+        exports = Queue.Queue()
+        exporter = None
+        if self.store is not None:
+            exporter = threading.Thread(target=self._export, args=(scan, exports))
+            exporter.daemon = True
+            exporter.start()
+
+        scan.started = time.time()
+        scan._set_state(RUNNING)
+        state = DONE
+        try:
+            if scan.continuous:
+                self._sweep(scan, exports)
+            else:
+                self._step(scan, exports)
+        except ScanAborted:
+            state = ABORTED
+        except Exception:
+            scan.error = traceback.format_exc()
+            state = FAILED
+        finally:
+            exports.put(None)
+            if exporter is not None:
+                exporter.join()
+            if scan.error is not None:
+                state = FAILED
+            if self.finish is not None:
+                try:
+                    self.finish(scan)
+                except Exception:
+                    scan.error = traceback.format_exc()
+                    state = FAILED
+            scan.finished = time.time()
+            scan._set_state(state)
@@ -0,0 +1,133 @@
+import math
+from collections import namedtuple
+
+import numpy as np
+
+"""
+Scan plans: the ordered list of points a scan visits. A point has a position
+(one coordinate per motor axis, in um) and a reference flag; reference points
+switch the shutters to the reference arm and take a calibration frame at the
+current position (their position is None) instead of moving.
+
+Plans are made from explicit positions or generated (line, grid), can be
+repeated and interleaved with reference points, and are ordered to keep the
+total travel short: grids are traversed serpentine, repeated passes go back
+and forth, and arbitrary point sets can be ordered nearest neighbour first.
+estimate() gives the duration of a plan from the motor velocity and
+acceleration before it is run.
+"""
+
+ScanPoint = namedtuple("ScanPoint", ["position", "reference"])
+
+
+def points(positions):
+    return [ScanPoint(tuple(np.atleast_1d(p).astype(float)), False) for p in positions]
+
+
+# steps points along one axis, each after a move of length/steps from start
+# (the first frame is taken one step after start, as the original slice routine did)
+def line(start, length, steps):
+    return points(start + length*np.arange(1, steps + 1)/float(steps))
+
+
+# points on an n-dimensional grid, the last axis changes fastest and reverses
+# direction on every row (serpentine), starts/lengths/steps have one entry per axis
+def grid(starts, lengths, steps):
+    axes = [start + length*np.arange(n)/float(max(n - 1, 1)) for start, length, n in zip(starts, lengths, steps)]
+    positions = [()]
+    for axis in axes:
+        rows = []
+        for row, prefix in enumerate(positions):
+            values = axis if row % 2 == 0 else axis[::-1]
+            rows.extend(prefix + (value,) for value in values)
+        positions = rows
+    return points(positions)
+
+
+# the plan passes times in a row, every other pass backwards so the motor does not fly back
+def repeat(plan, passes, alternate=True):
+    repeated = []
+    for n in range(passes):
+        repeated.extend(plan[::-1] if alternate and n % 2 == 1 else plan)
+    return repeated
+
+
+# a reference point before the plan and after every `every` sample points
+def interleave_reference(plan, every):
+    interleaved = [ScanPoint(None, True)]
+    samples = 0
+    for point in plan:
+        interleaved.append(point)
+        if not point.reference:
+            samples += 1
+            if every > 0 and samples % every == 0:
+                interleaved.append(ScanPoint(None, True))
+    return interleaved
+
+
+# greedy nearest neighbour ordering of the sample points, starting closest to start;
+# reference points keep their position in the sequence of visited points
+def nearest_neighbour(plan, start=None):
+    samples = [point for point in plan if not point.reference]
+    if not samples:
+        return list(plan)
+    remaining = np.array([point.position for point in samples])
+    current = remaining[0] if start is None else np.atleast_1d(start).astype(float)
+    order = []
+    left = list(range(len(samples)))
+    while left:
+        distances = np.abs(remaining[left] - current).max(axis=1)
+        index = left.pop(int(np.argmin(distances)))
+        order.append(samples[index])
+        current = remaining[index]
+
+    ordered = iter(order)
+    return [point if point.reference else next(ordered) for point in plan]
+
+
+# time (s) for a move of distance um with a trapezoidal velocity profile
+def move_time(distance, velocity, acceleration=None):
+    distance = abs(distance)
+    if distance == 0:
+        return 0.0
+    if not acceleration:
+        return distance/velocity
+    if distance < velocity**2/acceleration:
+        # the motor never reaches full speed
+        return 2*math.sqrt(distance/acceleration)
+    return distance/velocity + velocity/acceleration
+
+
+# sum of the absolute moves of the plan from start, per axis
+def travel(plan, start=None):
+    total = None
+    current = None if start is None else np.atleast_1d(start).astype(float)
+    for point in plan:
+        if point.reference:
+            continue
+        position = np.array(point.position)
+        if current is not None:
+            step = np.abs(position - current)
+            total = step if total is None else total + step
+        current = position
+    return total if total is not None else np.zeros(0)
+
+
+# estimated duration (s) of the plan from start; axes move at the same time, and
+# every point costs settle + frame seconds after the move
+def estimate(plan, velocity, acceleration=None, start=None, settle=0.0, frame=0.0):
+    total = 0.0
+    current = None if start is None else np.atleast_1d(start).astype(float)
+    for point in plan:
+        if not point.reference:
+            position = np.array(point.position)
+            if current is not None:
+                total += max(move_time(d, velocity, acceleration) for d in position - current)
+            current = position
+        total += settle + frame
+    return total
+
+
+def summary(plan):
+    samples = sum(1 for point in plan if not point.reference)
+    return "%d points, %d reference" % (samples, len(plan) - samples)
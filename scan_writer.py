@@ -0,0 +1,191 @@
+import glob
+import json
+import os
+import threading
+import traceback
+import Queue
+
+import numpy as np
+from PIL import Image
+
+import lorentzian_fit
+
+"""
+Writes the frames of a scan at native depth while the scan runs. Frames are
+collected into chunks of chunk_size slices; every full chunk is compressed
+and saved by a background thread as <path>/chunk_NNNNN.npz (the frames as one
+uint16 stack plus a SLICE_DTYPE record per slice: sequence number, motor
+position, timestamp, shutter state and the fit of the slice, and the readout
+geometry of the frames), and manifest.json is rewritten after every chunk.
+Frames read out from a cropped, binned ROI are stored as they are, so the
+geometry says which sensor area and binning they come from. Memory use is bounded by the chunk size, and
+an interrupted scan can still be read up to the last saved chunk.
+
+ScanReader opens a scan lazily: the records of all slices are read up front,
+frames only when they are asked for, one chunk at a time.
+"""
+
+# position has one coordinate per motor axis, nan for missing axes and reference slices
+AXES = 3
+SLICE_DTYPE = np.dtype([("seq", np.int64),
+                        ("position", np.float64, (AXES,)),
+                        ("timestamp", np.float64),
+                        ("shutter", np.int8),
+                        ("shift", np.float64),
+                        ("shift_error", np.float64),
+                        ("fit", np.float64, (lorentzian_fit.N_PARAMS,))])
+
+
+def chunk_name(chunk):
+    return "chunk_%05d.npz" % chunk
+
+
+class ScanWriter(object):
+    def __init__(self, path, chunk_size=16, metadata=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.metadata = metadata or {}
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.frames = []
+        self.records = []
+        self.readout = None
+        self.chunks = []
+        self.count = 0
+        self.error = None
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self._save, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    # position is a number or one per axis (None for reference slices), fit is the
+    # parameter vector of the lorentzian fit (None if not fitted), readout the
+    # sensor area and binning of the frame (Andor_Camera.readout)
+    def append(self, frame, seq, position, timestamp, shutter=-1, shift=np.nan, shift_error=np.nan, fit=None, readout=None):
+        # a new readout (e.g. a spectral ROI) starts a new chunk
+        if self.frames and (frame.shape != self.frames[0].shape or readout != self.readout):
+            self._flush()
+        self.readout = readout
+        padded = np.full(lorentzian_fit.N_PARAMS, np.nan)
+        if fit is not None:
+            padded[:len(fit)] = fit
+        axes = np.full(AXES, np.nan)
+        if position is not None:
+            position = np.atleast_1d(position)
+            axes[:len(position)] = position
+        self.frames.append(np.asarray(frame, dtype=np.uint16))
+        self.records.append((seq, axes, timestamp, shutter,
+                             np.nan if shift is None else shift,
+                             np.nan if shift_error is None else shift_error, padded))
+        self.count += 1
+        if len(self.frames) == self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        if not self.frames:
+            return
+        self.queue.put((np.stack(self.frames), np.array(self.records, dtype=SLICE_DTYPE), self.readout))
+        self.frames = []
+        self.records = []
+
+    # saves the last partial chunk and waits for the background thread
+    def close(self):
+        self._flush()
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            print "Error writing scan ",self.path
+            print "Stack trace: ", self.error
+
+    def _save(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue
+            frames, records, readout = item
+            name = chunk_name(len(self.chunks))
+            try:
+                tmp = os.path.join(self.path, name + ".tmp")
+                with open(tmp, "wb") as f:
+                    np.savez_compressed(f, frames=frames, records=records, readout=json.dumps(readout))
+                os.rename(tmp, os.path.join(self.path, name))
+                self.chunks.append({"file": name, "slices": len(records), "shape": frames.shape[1:], "readout": readout})
+                self._write_manifest()
+            except Exception:
+                self.error = traceback.format_exc()
+
+    def _write_manifest(self):
+        manifest = {"chunks": self.chunks,
+                    "slices": sum(chunk["slices"] for chunk in self.chunks),
+                    "dtype": "uint16",
+                    "metadata": self.metadata}
+        tmp = os.path.join(self.path, "manifest.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=1)
+        if os.path.exists(os.path.join(self.path, "manifest.json")):
+            os.remove(os.path.join(self.path, "manifest.json"))
+        os.rename(tmp, os.path.join(self.path, "manifest.json"))
+
+
+class ScanReader(object):
+    def __init__(self, path):
+        self.path = path
+        manifest_path = os.path.join(path, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            files = [chunk["file"] for chunk in manifest["chunks"]]
+            self.metadata = manifest.get("metadata", {})
+        else:
+            # the scan died before the first manifest, use whatever chunks are complete
+            files = sorted(os.path.basename(p) for p in glob.glob(os.path.join(path, "chunk_*.npz")))
+            self.metadata = {}
+
+        self.files = files
+        records = []
+        # readout geometry of every chunk, None if it was not recorded
+        self.readouts = []
+        for name in files:
+            with np.load(os.path.join(path, name)) as data:
+                records.append(data["records"])
+                self.readouts.append(json.loads(str(data["readout"])) if "readout" in data.files else None)
+        self.records = np.concatenate(records) if records else np.zeros(0, dtype=SLICE_DTYPE)
+        # index of the first slice of every chunk
+        self.starts = np.cumsum([0] + [len(r) for r in records])
+        self._cached = (None, None)
+
+    def __len__(self):
+        return len(self.records)
+
+    def chunk(self, index):
+        if self._cached[0] != index:
+            with np.load(os.path.join(self.path, self.files[index])) as data:
+                self._cached = (index, data["frames"])
+        return self._cached[1]
+
+    # uint16 frame of slice i
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        index = np.searchsorted(self.starts, i, side="right") - 1
+        return self.chunk(index)[i - self.starts[index]]
+
+    # readout geometry of slice i
+    def readout(self, i):
+        return self.readouts[np.searchsorted(self.starts, i % len(self), side="right") - 1]
+
+    def frames(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+# writes the scan at path as a 16 bit multi page TIFF
+def export_tiff(path, tif):
+    reader = ScanReader(path)
+    images = [Image.fromarray(np.ascontiguousarray(frame, dtype=np.uint16)) for frame in reader.frames()]
+    if images:
+        images[0].save(tif, save_all=True, append_images=images[1:])
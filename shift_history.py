@@ -0,0 +1,108 @@
+
+import threading
+import numpy as np
+
+import lorentzian_fit
+
+"""
+Fixed capacity history of Brillouin shifts. Every entry keeps the frame
+sequence number, a timestamp, the shift, its uncertainty and the fit
+parameters. Entries are written twice into a buffer of twice the capacity,
+so the last n entries are always one contiguous slice and window() can hand
+out views instead of copies. Running mean/variance (Welford), min and max are
+kept for everything appended since the last reset, and an optional second,
+decimated history keeps block averages for long sessions.
+"""
+
+N_PARAMS = lorentzian_fit.N_PARAMS
+
+
+def history_dtype(n_params=N_PARAMS):
+    return np.dtype([("seq", np.int64),
+                     ("time", np.float64),
+                     ("shift", np.float64),
+                     ("shift_error", np.float64),
+                     ("params", np.float64, (n_params,))])
+
+
+class ShiftHistory(object):
+    def __init__(self, capacity=10000, n_params=N_PARAMS, decimation=0, decimated_capacity=100000):
+        self.capacity = capacity
+        self.n_params = n_params
+        self._data = np.zeros(2*capacity, dtype=history_dtype(n_params))
+        self.lock = threading.Lock()
+
+        # every decimation entries their average is appended to self.decimated
+        self.decimation = decimation
+        self.decimated = ShiftHistory(decimated_capacity, n_params) if decimation > 0 else None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.count = 0
+            self.n = 0
+            self.mean = 0.0
+            self._m2 = 0.0
+            self.min = np.inf
+            self.max = -np.inf
+            self._block = []
+        if self.decimated is not None:
+            self.decimated.reset()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, shift, timestamp, seq=-1, shift_error=np.nan, params=None):
+        with self.lock:
+            index = self.count % self.capacity
+            entry = (seq, timestamp, shift, shift_error, self._pad(params))
+            self._data[index] = entry
+            self._data[index + self.capacity] = entry
+            self.count += 1
+
+            # failed estimates are kept in the history but stay out of the statistics
+            if not np.isfinite(shift):
+                return
+
+            # Welford's running mean and variance
+            self.n += 1
+            delta = shift - self.mean
+            self.mean += delta/self.n
+            self._m2 += delta*(shift - self.mean)
+            self.min = min(self.min, shift)
+            self.max = max(self.max, shift)
+
+            block = None
+            if self.decimated is not None:
+                self._block.append((seq, timestamp, shift, shift_error))
+                if len(self._block) == self.decimation:
+                    block = np.array(self._block)
+                    self._block = []
+        if block is not None:
+            self.decimated.append(block[:, 2].mean(), block[:, 1].mean(), int(block[-1, 0]), block[:, 3].mean())
+
+    def _pad(self, params):
+        padded = np.full(self.n_params, np.nan)
+        if params is not None:
+            padded[:len(params)] = params
+        return padded
+
+    @property
+    def variance(self):
+        return self._m2/(self.n - 1) if self.n > 1 else 0.0
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    # view of the last n entries (all of them if n is None), oldest first
+    def window(self, n=None):
+        with self.lock:
+            length = len(self)
+            n = length if n is None else min(n, length)
+            end = (self.count - 1) % self.capacity + self.capacity + 1 if self.count else 0
+            return self._data[end - n:end]
+
+    def last(self):
+        window = self.window(1)
+        return window[0] if len(window) else None
@@ -0,0 +1,68 @@
+
+import numpy as np
+import spectrum_analysis
+
+"""
+Region of the EMCCD sensor that holds the spectral line. It is located once
+on a full frame, after which the camera only reads out those columns with the
+rows binned together on chip (see Andor_Camera.set_readout), so every frame
+is a single (1, columns) row. The ROI keeps checking that row and asks for a
+new full frame calibration when the line has moved or faded.
+"""
+
+# extra columns read out on each side of the analyzed window so the window can follow small drifts
+MARGIN = 20
+
+
+class SpectralROI(object):
+    # row/column limits are 1-based and inclusive in sensor pixels, as SetImage expects
+    def __init__(self, row_start, row_end, col_start, col_end, peak, hbin=1, interval=50, threshold=0.3, max_failures=3):
+        self.row_start = row_start
+        self.row_end = row_end
+        self.col_start = col_start
+        self.col_end = col_end
+        self.hbin = hbin
+        # brightest binned pixel at calibration time
+        self.peak = peak
+
+        # check every interval frames, give up after max_failures checks in a row
+        self.interval = interval
+        self.threshold = threshold
+        self.max_failures = max_failures
+        self.count = 0
+        self.failures = 0
+
+    @property
+    def shape(self):
+        return (1, (self.col_end - self.col_start + 1) // self.hbin)
+
+    # False once the spectral line is no longer inside the ROI
+    def check(self, frame):
+        self.count += 1
+        if self.count % self.interval != 0:
+            return True
+
+        row = frame[0]
+        background = np.median(row)
+        peak = row.argmax()
+        edge = spectrum_analysis.WINDOW//4
+        if row[peak] - background < self.threshold*(self.peak - background) or peak < edge or peak >= row.size - edge:
+            self.failures += 1
+        else:
+            self.failures = 0
+        return self.failures < self.max_failures
+
+
+# locates the spectral line on a full binned frame and returns its SpectralROI
+def locate_roi(frame, hbin, vbin, margin=MARGIN, **kwargs):
+    loc, mid = spectrum_analysis.locate_spectrum(frame)
+    rows = spectrum_analysis.CROP_ROWS
+    first_row = max(loc - rows, 0)
+    last_row = min(loc + rows, frame.shape[0])
+    first_col = max(mid - spectrum_analysis.WINDOW//2 - margin, 0)
+    last_col = min(mid + spectrum_analysis.WINDOW//2 + margin, frame.shape[1])
+
+    peak = float(frame[first_row:last_row, first_col:last_col].sum(axis=0).max())
+    return SpectralROI(first_row*vbin + 1, last_row*vbin,
+                       first_col*hbin + 1, last_col*hbin,
+                       peak, hbin, **kwargs)
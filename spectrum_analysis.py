@@ -0,0 +1,83 @@
+
+import numpy as np
+import lorentzian_fit as lf
+import peak_finding
+import fast_shift
+
+"""
+Per-frame EMCCD spectrum analysis that used to live inside App.andorLoop and
+App.graphLoop. Everything here is plain numpy on the raw frame so it can run
+in the analysis worker processes, away from the GUI and camera threads.
+"""
+
+# width of the analyzed spectrum window and half height of the displayed crop
+WINDOW = 80
+CROP_ROWS = 7
+
+
+# finds the row holding the spectrum and the center of the window around it
+def locate_spectrum(frame):
+    loc = int(np.argmax(frame)) // frame.shape[1]
+    mid = peak_finding.window_center(frame[loc])
+    mid = min(max(mid, WINDOW//2), frame.shape[1] - WINDOW//2)
+    return loc, mid
+
+
+# 8-bit, max scaled crop around the spectrum for the EMCCD panel
+def display_crop(frame, loc, mid):
+    maximum = max(int(frame.max()), 1)
+    cropped = frame[max(loc - CROP_ROWS, 0):loc + CROP_ROWS, mid - WINDOW//2:mid + WINDOW//2]
+    return (cropped*(255.0/maximum)).astype(np.uint8)
+
+
+# brillouin shift of the sample spectrum (two peaks) from the closed form
+# estimator, refined by a lorentzian fit when fit is True
+def analyze_sample(row, x_axis, FSR, SD, fit=True):
+    shift, shift_error, center, width = fast_shift.estimate_shift(row, FSR, SD)
+    result = {"shift": shift[0], "shift_error": shift_error[0], "fit": None}
+    if not fit:
+        return result
+
+    position, height, width, bg = peak_finding.find_peaks(row, lf.SAMPLE_PEAKS)
+    popt, converged = lf.fit_spectra(row, lf.guess_from_peaks(position, height, width, bg, x_axis), x = x_axis)
+    if converged[0]:
+        result["fit"] = popt[0]
+        result["shift"] = (FSR - (popt[0, 4] - popt[0, 1])*SD)/2
+    return result
+
+
+# lorentzian fit of the reference spectrum (four peaks) and the SD/FSR calibration from it
+def analyze_reference(row, x_axis, plastic_bs, water_bs):
+    position, height, width, bg = peak_finding.find_peaks(row, lf.REFERENCE_PEAKS)
+    x0_1, x0_2, x0_3, x0_4 = position[0]
+
+    popt, converged = lf.fit_spectra(row, lf.guess_from_peaks(position, height, width, bg, x_axis), x = x_axis)
+
+    measured_SD = (2*plastic_bs - 2*water_bs) / ((x0_4 - x0_1) + (x0_3 - x0_2))
+    measured_FSR = 2*plastic_bs - measured_SD*(x0_3 - x0_2)
+    return {"shift": None,
+            "fit": popt[0] if converged[0] else None,
+            "SD": measured_SD,
+            "FSR": measured_FSR}
+
+
+# full analysis of one raw frame, job holds the GUI settings at acquisition time
+# fit=False skips the lorentzian fit of sample spectra (fast mode),
+# timestamp is the acquisition time of the frame and is passed through to the result
+def analyze_frame(frame, reference=False, FSR=16.2566, SD=0.14288, plastic_bs=9.6051, water_bs=5.1157, fit=True, timestamp=None):
+    loc, mid = locate_spectrum(frame)
+    row = np.array(frame[loc, mid - WINDOW//2:mid + WINDOW//2], dtype=np.float64)
+    x_axis = np.arange(1, WINDOW + 1)
+
+    if reference:
+        result = analyze_reference(row, x_axis, plastic_bs, water_bs)
+    else:
+        result = analyze_sample(row, x_axis, FSR, SD, fit)
+
+    result.update({"loc": loc,
+                   "mid": mid,
+                   "row": row,
+                   "reference": reference,
+                   "timestamp": timestamp,
+                   "display": display_crop(frame, loc, mid)})
+    return result
@@ -0,0 +1,53 @@
+import unittest
+
+import numpy as np
+
+import adaptive_scan
+
+
+class RefineTest(unittest.TestCase):
+    def test_refines_around_a_step(self):
+        positions = np.arange(0.0, 110.0, 10.0)
+        shifts = np.where(positions < 45, 5.0, 6.0)
+        errors = np.full(len(positions), 0.01)
+        np.testing.assert_array_equal(adaptive_scan.refine(positions, shifts, errors, 5, 1.0), [45.0])
+
+    def test_flat_profile_needs_no_refinement(self):
+        positions = np.arange(0.0, 50.0, 10.0)
+        shifts = 5.0 + np.array([0.0, 0.01, -0.01, 0.0, 0.01])
+        self.assertEqual(len(adaptive_scan.refine(positions, shifts, np.full(5, 0.01), 5, 1.0)), 0)
+
+    def test_positions_need_not_be_sorted(self):
+        positions = np.array([30.0, 0.0, 20.0, 10.0])
+        shifts = np.array([6.0, 5.0, 6.0, 5.0])
+        np.testing.assert_array_equal(adaptive_scan.refine(positions, shifts, np.full(4, 0.01), 5, 1.0), [15.0])
+
+    def test_max_points_keeps_the_steepest_intervals(self):
+        positions = np.arange(0.0, 50.0, 10.0)
+        shifts = np.array([5.0, 5.2, 5.2, 6.0, 6.1])
+        errors = np.full(5, 0.01)
+        np.testing.assert_array_equal(adaptive_scan.refine(positions, shifts, errors, 1, 1.0), [25.0])
+        np.testing.assert_array_equal(adaptive_scan.refine(positions, shifts, errors, 2, 1.0), [5.0, 25.0])
+        self.assertEqual(len(adaptive_scan.refine(positions, shifts, errors, 0, 1.0)), 0)
+
+    def test_intervals_below_min_step_are_not_split(self):
+        positions = np.array([0.0, 1.5, 10.0])
+        shifts = np.array([5.0, 6.0, 6.0])
+        self.assertEqual(len(adaptive_scan.refine(positions, shifts, np.full(3, 0.01), 5, 1.0)), 0)
+
+    def test_failed_and_noisy_fits_are_refined(self):
+        positions = np.arange(0.0, 50.0, 10.0)
+        shifts = np.array([5.0, 5.0, np.nan, 5.0, 5.0])
+        errors = np.array([0.01, 0.01, np.nan, 0.01, 0.01])
+        np.testing.assert_array_equal(adaptive_scan.refine(positions, shifts, errors, 5, 1.0), [15.0, 25.0])
+
+        shifts = np.full(5, 5.0)
+        errors = np.array([0.01, 0.01, 0.01, 0.1, 0.01])
+        np.testing.assert_array_equal(adaptive_scan.refine(positions, shifts, errors, 5, 1.0), [25.0, 35.0])
+
+    def test_too_few_points(self):
+        self.assertEqual(len(adaptive_scan.refine([0.0], [5.0], [0.01], 5, 1.0)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+import numpy as np
+
+import lorentzian_fit
+
+
+SAMPLE = np.array([4.0, 25.0, 300.0, 4.5, 55.0, 280.0, 100.0])
+
+
+class LorentzianFitTest(unittest.TestCase):
+    def test_jacobian_matches_finite_differences(self):
+        x = lorentzian_fit.DEFAULT_X
+        params = np.array([SAMPLE, SAMPLE*[1.2, 0.9, 0.7, 0.8, 1.1, 1.3, 0.5]])
+        jac = lorentzian_fit.lorentzian_jacobian(x, params)
+        self.assertEqual(jac.shape, (2, len(x), len(SAMPLE)))
+
+        step = 1e-6
+        for p in range(params.shape[1]):
+            up = params.copy()
+            down = params.copy()
+            up[:, p] += step
+            down[:, p] -= step
+            numeric = (lorentzian_fit.lorentzian_peaks(x, up) - lorentzian_fit.lorentzian_peaks(x, down))/(2*step)
+            np.testing.assert_allclose(jac[:, :, p], numeric, rtol=1e-5, atol=1e-6)
+
+    def test_fit_recovers_a_batch_of_sample_spectra(self):
+        x = lorentzian_fit.DEFAULT_X
+        truth = np.array([SAMPLE, SAMPLE + [0.5, 2.0, 0, -0.5, -3.0, 0, 20]])
+        rng = np.random.RandomState(0)
+        rows = lorentzian_fit.lorentzian_peaks(x, truth) + rng.normal(0, 0.5, (2, len(x)))
+
+        params, converged = lorentzian_fit.fit_sample(rows)
+        self.assertTrue(converged.all())
+        # peak positions and background
+        np.testing.assert_allclose(params[:, [1, 4]], truth[:, [1, 4]], atol=0.05)
+        np.testing.assert_allclose(params[:, -1], truth[:, -1], rtol=0.05)
+
+    def test_num_params(self):
+        self.assertEqual(lorentzian_fit.num_params(lorentzian_fit.SAMPLE_PEAKS), 7)
+        self.assertEqual(lorentzian_fit.N_PARAMS, 13)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+import numpy as np
+
+import lorentzian_fit
+import peak_finding
+
+
+def spectrum(positions, width=3.0, height=200.0, bg=50.0, w=80):
+    x = np.arange(w, dtype=np.float64)
+    row = np.full(w, bg)
+    for position in positions:
+        row += height/(1 + ((x - position)/(width/2))**2)
+    return row
+
+
+class PeakFindingTest(unittest.TestCase):
+    def test_segment_maxima(self):
+        rows = spectrum([12.0, 61.0])
+        np.testing.assert_array_equal(peak_finding.segment_maxima(rows, 2), [[12, 61]])
+
+    def test_refine_is_sub_pixel(self):
+        rows = np.array([spectrum([20.3, 60.7]), spectrum([19.6, 59.4])])
+        index = peak_finding.segment_maxima(rows, 2)
+        for method in ("parabolic", "lorentzian", "centroid"):
+            position = peak_finding.refine(rows, index, method)
+            np.testing.assert_allclose(position, [[20.3, 60.7], [19.6, 59.4]], atol=0.3)
+        # a lorentzian line is matched almost exactly by the lorentzian refinement (up to the other peak's tail)
+        position = peak_finding.refine(rows, index, "lorentzian", bg=np.full(2, 50.0))
+        np.testing.assert_allclose(position, [[20.3, 60.7], [19.6, 59.4]], atol=1e-3)
+
+    def test_refine_rejects_unknown_methods(self):
+        rows = spectrum([20.0])
+        self.assertRaises(ValueError, peak_finding.refine, rows, [[20]], "cubic")
+
+    def test_fwhm(self):
+        rows = spectrum([20.0, 60.0], width=6.0)
+        width = peak_finding.fwhm(rows, [[20, 60]], bg=np.array([50.0]), segment=40)
+        np.testing.assert_allclose(width, [[6.0, 6.0]], atol=0.5)
+
+    def test_find_peaks(self):
+        rows = spectrum([20.0, 60.0], width=4.0)
+        position, height, width, bg = peak_finding.find_peaks(rows, 2)
+        np.testing.assert_allclose(position, [[20.0, 60.0]], atol=0.05)
+        np.testing.assert_allclose(width, [[4.0, 4.0]], atol=0.5)
+        self.assertTrue((height > 150).all())
+        # the guess built from them is close enough for the fit to converge
+        params, converged = lorentzian_fit.fit_sample(rows)
+        self.assertTrue(converged.all())
+
+    def test_single_row_window_center(self):
+        self.assertTrue(abs(peak_finding.window_center(spectrum([40.0])) - 40) <= 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import pupil_log
+
+
+class PupilLogTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "pupil.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, frames, flush_every=4):
+        log = pupil_log.PupilLog(self.path, flush_every)
+        for i in range(frames):
+            center = None if i % 3 == 0 else (10 + i, 20 + i)
+            log.append(i, 100.0 + i, 0.5*i, center, 30, i % 3 != 0, i // 2, 0.1*i, "ellipse", i % 3 == 0, i == 4)
+        return log
+
+    def test_round_trip(self):
+        self.write(10).close()
+        records = pupil_log.load(self.path)
+        self.assertEqual(len(records), 10)
+        np.testing.assert_array_equal(records["frame"], np.arange(10))
+        np.testing.assert_array_equal(records["brillouin_seq"], np.arange(10) // 2)
+        self.assertTrue(np.isnan(records["x"][0]))
+        self.assertEqual((records["x"][1], records["y"][1], records["radius"][1]), (11, 21, 30))
+        np.testing.assert_array_equal(records["detected"], [i % 3 != 0 for i in range(10)])
+        np.testing.assert_allclose(records["confidence"], 0.1*np.arange(10), rtol=1e-6)
+        self.assertEqual(records["detector"][4], b"ellipse")
+        np.testing.assert_array_equal(records["blink"], [i % 3 == 0 for i in range(10)])
+        np.testing.assert_array_equal(np.nonzero(records["saccade"])[0], [4])
+
+    def test_only_full_blocks_are_on_disk_before_close(self):
+        log = self.write(6)
+        self.assertEqual(len(pupil_log.load(self.path)), 4)
+        log.close()
+        self.assertEqual(len(pupil_log.load(self.path)), 6)
+
+    def test_torn_last_record_is_ignored(self):
+        self.write(5).close()
+        with open(self.path, "ab") as f:
+            f.write(b"\1"*(pupil_log.LOG_DTYPE.itemsize // 2))
+        self.assertEqual(len(pupil_log.load(self.path)), 5)
+
+    def test_other_files_are_rejected(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a pupil log at all")
+        self.assertRaises(ValueError, pupil_log.load, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
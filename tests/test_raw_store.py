@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import raw_store
+
+
+class RawStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "frames")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def frame(self, i):
+        return (np.arange(12, dtype=np.uint16).reshape(3, 4) + 1000*i).astype(np.uint16)
+
+    def test_round_trip_grows_past_capacity(self):
+        writer = raw_store.RawStoreWriter(self.path, (3, 4), np.uint16, capacity=2, metadata={"readout": {"hbin": 1}})
+        for i in range(5):
+            writer.append(self.frame(i), 10 + i, 0.5*i, 100.0*i, i % 2)
+        writer.close()
+        self.assertEqual(os.path.getsize(self.path + ".raw"), 5*12*2)
+
+        store = raw_store.RawStore(self.path)
+        self.assertEqual(len(store), 5)
+        self.assertEqual(store.shape, (3, 4))
+        self.assertEqual(store.dtype, np.uint16)
+        self.assertEqual(store.metadata, {"readout": {"hbin": 1}})
+        for i in range(5):
+            np.testing.assert_array_equal(store[i], self.frame(i))
+        frames, index = store.range(1, 3)
+        np.testing.assert_array_equal(index["seq"], [11, 12])
+        np.testing.assert_array_equal(index["position"], [100.0, 200.0])
+        np.testing.assert_array_equal(index["shutter"], [1, 0])
+        self.assertEqual(store.find(13), 3)
+        self.assertIsNone(store.find(99))
+
+    def test_unclosed_store_is_readable_up_to_the_last_flush(self):
+        writer = raw_store.RawStoreWriter(self.path, (3, 4), np.uint16, capacity=8, flush_every=2)
+        for i in range(3):
+            writer.append(self.frame(i), i, 0.0)
+        store = raw_store.RawStore(self.path)
+        self.assertEqual(len(store), 2)
+        writer.close()
+        self.assertEqual(len(raw_store.RawStore(self.path)), 3)
+
+    def test_wrong_shape_is_rejected(self):
+        writer = raw_store.RawStoreWriter(self.path, (3, 4), np.uint16)
+        self.assertRaises(ValueError, writer.append, np.zeros((4, 3), np.uint16), 0, 0.0)
+        writer.close()
+        self.assertEqual(len(raw_store.RawStore(self.path)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
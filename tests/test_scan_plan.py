@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+
+import scan_plan
+
+
+def positions(plan):
+    return [point.position for point in plan if not point.reference]
+
+
+class ScanPlanTest(unittest.TestCase):
+    def test_line_starts_one_step_after_start(self):
+        self.assertEqual(positions(scan_plan.line(100.0, 30.0, 3)), [(110.0,), (120.0,), (130.0,)])
+
+    def test_grid_is_serpentine(self):
+        plan = scan_plan.grid([0.0, 0.0], [10.0, 20.0], [2, 3])
+        self.assertEqual(positions(plan), [(0.0, 0.0), (0.0, 10.0), (0.0, 20.0),
+                                           (10.0, 20.0), (10.0, 10.0), (10.0, 0.0)])
+        # only the slow axis moves between rows
+        self.assertEqual(list(scan_plan.travel(plan)), [10.0, 40.0])
+
+    def test_grid_with_one_step_stays_at_start(self):
+        self.assertEqual(positions(scan_plan.grid([5.0], [10.0], [1])), [(5.0,)])
+
+    def test_repeat_alternates_direction(self):
+        plan = scan_plan.points([1.0, 2.0, 3.0])
+        self.assertEqual(positions(scan_plan.repeat(plan, 3)), [(1.0,), (2.0,), (3.0,), (3.0,), (2.0,), (1.0,),
+                                                                (1.0,), (2.0,), (3.0,)])
+        self.assertEqual(positions(scan_plan.repeat(plan, 2, alternate=False)), positions(plan)*2)
+
+    def test_interleave_reference(self):
+        plan = scan_plan.interleave_reference(scan_plan.points([1.0, 2.0, 3.0]), 2)
+        self.assertEqual([point.reference for point in plan], [True, False, False, True, False])
+        self.assertIsNone(plan[0].position)
+
+    def test_nearest_neighbour_keeps_references_in_place(self):
+        plan = scan_plan.interleave_reference(scan_plan.points([0.0, 50.0, 10.0, 40.0]), 2)
+        ordered = scan_plan.nearest_neighbour(plan, start=0.0)
+        self.assertEqual(positions(ordered), [(0.0,), (10.0,), (40.0,), (50.0,)])
+        self.assertEqual([point.reference for point in ordered], [point.reference for point in plan])
+
+    def test_move_time(self):
+        self.assertEqual(scan_plan.move_time(0, 100.0, 1000.0), 0.0)
+        self.assertEqual(scan_plan.move_time(-50.0, 100.0), 0.5)
+        # reaches full speed: accelerating and braking cost velocity/acceleration
+        self.assertAlmostEqual(scan_plan.move_time(100.0, 100.0, 1000.0), 1.1)
+        # triangular profile
+        self.assertAlmostEqual(scan_plan.move_time(2.5, 100.0, 1000.0), 0.1)
+
+    def test_estimate(self):
+        plan = scan_plan.interleave_reference(scan_plan.line(0.0, 200.0, 2), 0)
+        # moves of 100 um from the start, every point (the reference too) settles and exposes
+        self.assertAlmostEqual(scan_plan.estimate(plan, 100.0, None, 0.0, settle=0.1, frame=0.2), 2*1.0 + 3*0.3)
+        # the time of the first move is unknown without a start position
+        self.assertAlmostEqual(scan_plan.estimate(plan, 100.0, None), 1.0)
+        # axes move at the same time
+        grid = scan_plan.grid([0.0, 0.0], [100.0, 300.0], [2, 2])
+        self.assertAlmostEqual(scan_plan.estimate(grid, 100.0), 3.0 + 1.0 + 3.0)
+
+    def test_summary(self):
+        plan = scan_plan.interleave_reference(scan_plan.line(0.0, 10.0, 4), 2)
+        self.assertEqual(scan_plan.summary(plan), "4 points, 3 reference")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+import numpy as np
+
+import shift_history
+
+
+class ShiftHistoryTest(unittest.TestCase):
+    def test_empty_window(self):
+        history = shift_history.ShiftHistory(capacity=4)
+        self.assertEqual(len(history.window()), 0)
+        self.assertIsNone(history.last())
+
+    def test_window_before_wrapping(self):
+        history = shift_history.ShiftHistory(capacity=4)
+        for seq in range(3):
+            history.append(5.0 + seq, 10.0*seq, seq)
+        np.testing.assert_array_equal(history.window()["seq"], [0, 1, 2])
+        np.testing.assert_array_equal(history.window(2)["shift"], [6.0, 7.0])
+        np.testing.assert_array_equal(history.window(10)["seq"], [0, 1, 2])
+
+    def test_window_is_a_contiguous_view_after_wrapping(self):
+        history = shift_history.ShiftHistory(capacity=4)
+        for seq in range(11):
+            history.append(float(seq), float(seq), seq)
+        window = history.window()
+        np.testing.assert_array_equal(window["seq"], [7, 8, 9, 10])
+        np.testing.assert_array_equal(history.window(3)["shift"], [8.0, 9.0, 10.0])
+        self.assertEqual(history.last()["seq"], 10)
+        # a view on the buffer, not a copy
+        self.assertFalse(window.flags.owndata)
+        self.assertTrue(window.flags.c_contiguous)
+
+    def test_running_statistics_cover_everything_since_reset(self):
+        history = shift_history.ShiftHistory(capacity=3)
+        shifts = [5.1, 5.3, 4.9, 5.0, 5.6]
+        for seq, shift in enumerate(shifts):
+            history.append(shift, seq, seq)
+        self.assertAlmostEqual(history.mean, np.mean(shifts))
+        self.assertAlmostEqual(history.std, np.std(shifts, ddof=1))
+        self.assertEqual((history.min, history.max), (4.9, 5.6))
+
+        history.reset()
+        self.assertEqual(len(history.window()), 0)
+        self.assertEqual(history.mean, 0.0)
+
+    def test_failed_shifts_are_stored_but_not_counted(self):
+        history = shift_history.ShiftHistory(capacity=4, decimation=2)
+        for seq, shift in enumerate([5.0, np.nan, 5.1, 5.3]):
+            history.append(shift, seq, seq)
+        self.assertEqual(len(history.window()), 4)
+        self.assertTrue(np.isnan(history.window()["shift"][1]))
+        self.assertAlmostEqual(history.mean, np.mean([5.0, 5.1, 5.3]))
+        self.assertAlmostEqual(history.std, np.std([5.0, 5.1, 5.3], ddof=1))
+        self.assertEqual((history.min, history.max), (5.0, 5.3))
+        np.testing.assert_allclose(history.decimated.window()["shift"], [5.05])
+
+    def test_params_are_padded(self):
+        history = shift_history.ShiftHistory(capacity=2)
+        history.append(5.0, 0.0, 0, 0.01, [1.0, 2.0])
+        params = history.last()["params"]
+        np.testing.assert_array_equal(params[:2], [1.0, 2.0])
+        self.assertTrue(np.isnan(params[2:]).all())
+
+    def test_decimated_history_keeps_block_averages(self):
+        history = shift_history.ShiftHistory(capacity=4, decimation=3)
+        for seq in range(7):
+            history.append(float(seq), float(seq), seq)
+        np.testing.assert_array_equal(history.decimated.window()["shift"], [1.0, 4.0])
+        np.testing.assert_array_equal(history.decimated.window()["seq"], [2, 5])
+
+
+if __name__ == "__main__":
+    unittest.main()